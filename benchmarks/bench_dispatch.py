@@ -0,0 +1,99 @@
+"""测量 handle_text_message 在真实聊天流量下每秒能处理的消息数.
+
+流量由大量无关聊天和少量插件命令混合而成。需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_dispatch.py [--messages 200000] [--command-ratio 0.01]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+from plugins.BiliSearchPlugin.main import BiliSearchPlugin  # noqa: E402
+
+CHATTER = [
+    "哈哈哈哈",
+    "今天中午吃什么",
+    "有人一起打游戏吗？",
+    "[图片]",
+    "收到",
+    "第一次来这个群，大家好",
+    "这个视频真好看，B 站上还有第二季吗",
+    "明天开会记得带电脑，下午三点在二楼会议室，不要迟到了，谢谢大家配合",
+    "https://example.com/some/very/long/link?with=query&and=params",
+    "好的👌",
+]
+COMMANDS = ["视频 1", "序号 2", "下一页", "上一页", "第3集"]
+
+
+class NullBot:
+    """只统计发送次数的假客户端."""
+
+    wxid = "wxid_bench"
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text_message(self, chat_id, text):
+        self.sent += 1
+
+    async def send_app_message(self, chat_id, xml, type_):
+        self.sent += 1
+
+
+def legacy_match(plugin: BiliSearchPlugin, content: str) -> bool:
+    """旧实现的判断链，用于对比."""
+    if content.startswith(plugin.play_command):
+        return True
+    if content.startswith("序号 "):
+        return True
+    if content in ["下一页", "上一页", "最后一页"]:
+        return True
+    for command in plugin.commands:
+        if command in content:
+            return True
+    return content.startswith("第") and content.endswith("集")
+
+
+def make_traffic(count: int, command_ratio: float) -> list:
+    rng = random.Random(42)
+    return [
+        {"Content": rng.choice(COMMANDS) if rng.random() < command_ratio else rng.choice(CHATTER), "FromWxid": f"chat{rng.randrange(1000)}@chatroom"}
+        for _ in range(count)
+    ]
+
+
+def bench_matcher(name: str, match, messages: list) -> None:
+    start = time.perf_counter()
+    for message in messages:
+        match(message["Content"].strip())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(messages) / elapsed:>14,.0f} msg/s")
+
+
+async def bench_handler(plugin: BiliSearchPlugin, messages: list) -> None:
+    bot = NullBot()
+    start = time.perf_counter()
+    for message in messages:
+        await plugin.handle_text_message(bot, message)
+    elapsed = time.perf_counter() - start
+    print(f"{'handle_text_message':<24} {len(messages) / elapsed:>14,.0f} msg/s  (回复 {bot.sent} 条)")
+
+
+def main(args):
+    plugin = BiliSearchPlugin()
+    plugin.enable = True
+    messages = make_traffic(args.messages, args.command_ratio)
+    bench_matcher("旧判断链", lambda content: legacy_match(plugin, content), messages)
+    bench_matcher("预编译正则", plugin._command_pattern.match, messages)
+    asyncio.run(bench_handler(plugin, messages))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--command-ratio", type=float, default=0.01)
+    main(parser.parse_args())
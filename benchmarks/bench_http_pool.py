@@ -0,0 +1,82 @@
+"""对比“每次请求新建会话”和“共享连接池”两种方式的请求耗时.
+
+共享连接池直接使用插件的 _get_session() 创建，连接池和超时参数都来自 config.toml，测的就是插件实际使用的会话。
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_http_pool.py [--requests 500] [--concurrency 10]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+from stub_api import start_stub  # noqa: E402
+from plugins.BiliSearchPlugin.main import BiliSearchPlugin  # noqa: E402
+
+
+async def _per_call_session(url: str):
+    """旧实现：每次请求都新建会话，需要重新建立连接."""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        async with session.get(url) as response:
+            await response.read()
+
+
+async def _run(name: str, fetch, url: str, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await fetch(url)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "name": name,
+        "requests": requests,
+        "elapsed_s": round(elapsed, 4),
+        "req_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+async def main(args):
+    runner, base_url, _ = await start_stub()
+    url = f"{base_url}/api.php?msg=bench"
+    try:
+        results = [await _run("per_call_session", _per_call_session, url, args.requests, args.concurrency)]
+
+        plugin = BiliSearchPlugin()  # 新实现：插件自身的共享连接池
+        try:
+            async def pooled(target):
+                async with plugin._get_session().get(target) as response:
+                    await response.read()
+
+            results.append(await _run("pooled_session", pooled, url, args.requests, args.concurrency))
+        finally:
+            await plugin._close_session()
+    finally:
+        await runner.cleanup()
+
+    for result in results:
+        print(result)
+    saved = results[0]["p50_ms"] - results[1]["p50_ms"]
+    print(f"共享连接池每次请求的 p50 节省：{saved:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
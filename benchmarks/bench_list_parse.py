@@ -0,0 +1,132 @@
+"""比较 list_url 剧集列表的两种解析方式：一次性 json.loads 与流式增量解析.
+
+旧实现：读出完整响应体 → json.loads 得到全部剧集字典 → 为每一集生成展示标题。
+新实现：按 64KB 分块喂给 _EpisodeListParser，只保留剧集名和播放链接，渲染时只格式化当前页。
+
+默认使用 10000 集的数据，并额外测试 1000 / 50000 集以观察随剧集数的变化，
+输出每种方式的耗时和 tracemalloc 统计的峰值内存。
+计时之前先在每一个字节位置把一段包含小数、指数和 true/null 的响应体切成两块喂入，
+确认分块边界落在标量中间时解析结果与 json.loads 一致，不一致时以非零状态退出。
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_list_parse.py [--episodes 1000 10000 50000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.getcwd())
+from plugins.BiliSearchPlugin.main import _EpisodeListParser  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+PAGE_SIZE = 20
+
+
+def make_fixture(episodes: int) -> bytes:
+    """构造与线上接口结构一致的剧集列表响应体，每集附带一些插件用不到的字段."""
+    payload = {
+        "code": 200,
+        "msg": "success",
+        "data": [
+            {
+                "title": f"第{i + 1}集 这是一段比较长的剧集名称{i + 1}",
+                "mp4": f"https://upos-sz-mirror.example.com/upgcxcode/{i:08d}/{i + 1}-1-100026.mp4?e=ig8euxZM2rNcNbdlhoNvNC8BqJIzNbfq",
+                "cover": f"https://i0.hdslb.com/bfs/archive/{i:040x}.jpg",
+                "duration": 1420 + i % 60,
+                "cid": 100000000 + i,
+            }
+            for i in range(episodes)
+        ],
+    }
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+SPLIT_FIXTURE = (
+    '{"t":1.5e3,"ok":true,"code":200,"data":['
+    '{"title":"第1集","mp4":"https://example.com/1.mp4","duration":-12.75E-1},'
+    '1.25,null,'
+    '{"title":"第2集","mp4":"https://example.com/2.mp4"}'
+    '],"rate":0.5}'
+).encode("utf-8")
+
+
+def check_splits(body: bytes = SPLIT_FIXTURE) -> list:
+    """在每个字节位置把响应体切成两块解析，返回与 json.loads 结果不一致的切分位置."""
+    items = json.loads(body.decode("utf-8"))["data"]
+    expected = (
+        [f"{item.get('title', '')}" if isinstance(item, dict) else "" for item in items],
+        [(item.get("mp4") or "") if isinstance(item, dict) else "" for item in items],
+    )
+    failures = []
+    for split in range(1, len(body)):
+        parser = _EpisodeListParser()
+        try:
+            parser.feed(body[:split])
+            parser.feed(body[split:])
+            parser.feed(b"", final=True)
+        except ValueError as e:  # json.JSONDecodeError 也是 ValueError
+            failures.append(f"切分位置 {split}: {e}")
+            continue
+        if (parser.raw_titles, parser.urls) != expected:
+            failures.append(f"切分位置 {split}: 解析结果不一致")
+    return failures
+
+
+def parse_json_loads(body: bytes):
+    """旧实现：整体解码并为所有剧集生成展示标题."""
+    data = json.loads(body.decode("utf-8"))
+    items = data["data"]
+    titles = tuple(f"第{i + 1}集 {ep.get('title', '')}".replace(f" {i + 1}", "") for i, ep in enumerate(items))
+    urls = tuple(ep.get("mp4") or "" for ep in items)
+    return data, titles, urls  # data 在旧实现中会一直被持有到解析结束
+
+
+def parse_streaming(body: bytes):
+    """新实现：分块增量解析，只格式化第一页的标题."""
+    parser = _EpisodeListParser()
+    for offset in range(0, len(body), CHUNK_SIZE):
+        parser.feed(body[offset:offset + CHUNK_SIZE])
+    parser.feed(b"", final=True)
+    record = parser.result()
+    record.titles(0, PAGE_SIZE)
+    return record
+
+
+def measure(func, body: bytes, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"time_ms": round(best * 1000, 2), "peak_kb": round(peak / 1024, 1)}
+
+
+def main(args):
+    failures = check_splits()
+    if failures:
+        print("分块解析结果错误：\n  " + "\n  ".join(failures), file=sys.stderr)
+        sys.exit(1)
+    print(f"分块边界检查通过（{len(SPLIT_FIXTURE) - 1} 个切分位置）")
+
+    for episodes in args.episodes:
+        body = make_fixture(episodes)
+        print(f"\n剧集数 {episodes}，响应体 {len(body) / 1024:.0f} KB")
+        for name, func in (("json.loads", parse_json_loads), ("streaming", parse_streaming)):
+            print(f"  {name:<12} {measure(func, body, args.repeat)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
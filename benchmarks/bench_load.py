@@ -0,0 +1,156 @@
+"""插件整体负载测试.
+
+启动本地模拟接口和假的 WechatAPIClient，让大量聊天同时走一遍
+“B站 关键词” → “视频 N” → “下一页” → “序号 N” 的完整流程，统计吞吐量、
+handle_text_message 的 p50/p95/p99 延迟、上游请求次数和进程峰值内存，
+并输出 JSON，方便在不同提交之间对比。
+
+如果上游没有收到任何搜索或剧集列表请求、没有发出任何卡片消息，或者在未注入错误时
+出现了 “请先…” “未找到…” 等失败回复，说明插件没有真正走完流程：报告的 problems
+字段会列出原因，并以非零状态码退出，可以作为回归检查。
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_load.py --chats 2000 --keywords 50 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+from fake_bot import FakeWechatClient  # noqa: E402
+from stub_api import start_stub  # noqa: E402
+from plugins.BiliSearchPlugin.main import BiliSearchPlugin  # noqa: E402
+
+
+FAILURE_REPLIES = ("请先", "未找到", "无法", "无效", "处理")  # 流程没有走通时插件回复的文字开头
+
+
+def find_problems(report: dict, error_rate: float) -> list:
+    """检查报告中说明插件没有正常工作的迹象."""
+    problems = []
+    if not report["upstream_calls"].get("search"):
+        problems.append("上游没有收到任何搜索请求")
+    if not report["upstream_calls"].get("list"):
+        problems.append("上游没有收到任何剧集列表请求")
+    if not report["bot_sends"].get("app"):
+        problems.append("没有发出任何剧集卡片消息")
+    if not error_rate and report["failure_replies"]:
+        problems.append(f"未注入错误时出现了 {report['failure_replies']} 条失败回复")
+    return problems
+
+
+def percentile(ordered: list, percent: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_chat(plugin: BiliSearchPlugin, bot: FakeWechatClient, chat_id: str, keyword: str, rng: random.Random, latencies: list, think_time: float):
+    """模拟一个聊天的完整操作流程."""
+    flow = [
+        f"{plugin.commands[0]} {keyword}",
+        f"{plugin.play_command.strip()} {rng.randint(1, 3)}",
+        "下一页",
+        f"序号 {rng.randint(1, 20)}",
+    ]
+    for content in flow:
+        message = {"Content": content, "FromWxid": chat_id}
+        start = time.perf_counter()
+        await plugin.handle_text_message(bot, message)
+        latencies.append(time.perf_counter() - start)
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+
+async def main(args) -> dict:
+    runner, base_url, app = await start_stub(
+        latency=args.upstream_latency,
+        results=args.results,
+        episodes=args.episodes,
+        description_size=args.description_size,
+        error_rate=args.error_rate,
+    )
+    plugin = BiliSearchPlugin()
+    plugin.enable = True
+    plugin.api_url = f"{base_url}/api.php"
+    bot = FakeWechatClient(send_latency=args.send_latency, keep_messages=True)
+
+    rng = random.Random(args.seed)
+    # 关键词按近似 Zipf 分布挑选，少数热门关键词占大部分请求
+    weights = [1 / (rank + 1) for rank in range(args.keywords)]
+    keywords = rng.choices([f"番剧{rank}" for rank in range(args.keywords)], weights=weights, k=args.chats)
+    latencies = []
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            run_chat(plugin, bot, f"chat{i}@chatroom", keywords[i], random.Random(args.seed + i), latencies, args.think_time)
+            for i in range(args.chats)
+        ))
+        elapsed = time.perf_counter() - start
+    finally:
+        await plugin.on_disable()
+        await runner.cleanup()
+
+    latencies.sort()
+    report = {
+        "chats": args.chats,
+        "messages": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "upstream_calls": dict(app["stats"]),
+        "bot_sends": dict(bot.counts),
+        "failure_replies": sum(
+            1 for _, kind, _, content in bot.messages if kind == "text" and content.startswith(FAILURE_REPLIES)
+        ),
+        "outbox": plugin.get_outbox_stats(),
+        "peak_rss_mb": peak_rss_mb(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+    report["problems"] = find_problems(report, args.error_rate)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=2000, help="同时模拟的聊天数")
+    parser.add_argument("--keywords", type=int, default=50, help="关键词池大小")
+    parser.add_argument("--results", type=int, default=20, help="每次搜索返回的结果数")
+    parser.add_argument("--episodes", type=int, default=24, help="每个视频的剧集数")
+    parser.add_argument("--description-size", type=int, default=0, help="每条搜索结果简介追加的字符数")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="模拟上游接口的响应耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟上游返回 503 的比例")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="模拟微信发送消息的耗时（秒）")
+    parser.add_argument("--think-time", type=float, default=0.0, help="每步操作之间的最长随机间隔（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="把 JSON 报告写入该文件")
+    arguments = parser.parse_args()
+
+    result = asyncio.run(main(arguments))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if result["problems"]:
+        print("负载测试结果异常: " + "；".join(result["problems"]), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,131 @@
+"""多进程部署下的状态共享测试.
+
+启动本地模拟接口和若干个 worker 进程，每个进程各自创建一个插件实例。每个聊天依次发送
+“B站 关键词” → “视频 N” → “下一页” → “序号 N”，每一步都轮流交给不同的进程处理，
+统计因为会话丢失而回复 “请先…” 的次数、上游请求次数和耗时。
+分别用 memory 和 sqlite 两种状态后端运行，便于对比。
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_multiprocess.py --workers 4 --chats 500
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+from fake_bot import FakeWechatClient  # noqa: E402
+from stub_api import start_stub  # noqa: E402
+
+
+def chat_steps(plugin, chat_id: int, keywords: int) -> list:
+    return [
+        f"{plugin.commands[0]} 番剧{chat_id % keywords}",
+        f"{plugin.play_command.strip()} {chat_id % 3 + 1}",
+        "下一页",
+        f"序号 {chat_id % 20 + 1}",
+    ]
+
+
+async def run_worker(worker_id: int, args, base_url: str, db_path: str, barrier, results):
+    from plugins.BiliSearchPlugin.main import BiliSearchPlugin, _MemoryBackend, _SqliteBackend
+
+    plugin = BiliSearchPlugin()
+    plugin.enable = True
+    plugin.api_url = f"{base_url}/api.php"
+    plugin.state_multi_process = True
+    plugin._backend = _SqliteBackend(db_path, 0.05, 200) if args.backend == "sqlite" else _MemoryBackend()
+    bot = FakeWechatClient(keep_messages=True)
+
+    async def handle(chat_id: int, content: str):
+        await plugin.handle_text_message(bot, {"Content": content, "FromWxid": f"chat{chat_id}@chatroom"})
+
+    elapsed = 0.0
+    for step in range(4):
+        # 第 step 步交给 (chat_id + step) % workers 号进程处理，每一步都换一个进程
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            handle(chat_id, chat_steps(plugin, chat_id, args.keywords)[step])
+            for chat_id in range(args.chats)
+            if (chat_id + step) % args.workers == worker_id
+        ))
+        await plugin._backend.flush()
+        elapsed += time.perf_counter() - start
+        await asyncio.to_thread(barrier.wait)  # 所有进程完成这一步后再开始下一步
+
+    await plugin.on_disable()
+    lost = sum(1 for _, _, _, content in bot.messages if isinstance(content, str) and content.startswith("请先"))
+    results.put({"worker": worker_id, "lost_state": lost, "sends": dict(bot.counts), "elapsed_s": elapsed})
+
+
+def worker_main(worker_id: int, args, base_url: str, db_path: str, barrier, results):
+    asyncio.run(run_worker(worker_id, args, base_url, db_path, barrier, results))
+
+
+def start_stub_thread(args) -> tuple:
+    """在后台线程中运行模拟接口，返回 (base_url, app)."""
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner, base_url, app = loop.run_until_complete(start_stub(latency=args.upstream_latency))
+        holder.update(base_url=base_url, app=app)
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return holder["base_url"], holder["app"]
+
+
+def run(args) -> dict:
+    base_url, app = start_stub_thread(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(args.workers)
+        results = context.Queue()
+        processes = [
+            context.Process(target=worker_main, args=(i, args, base_url, os.path.join(tmp, "state.db"), barrier, results))
+            for i in range(args.workers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        workers = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+    return {
+        "backend": args.backend,
+        "workers": args.workers,
+        "chats": args.chats,
+        "messages": args.chats * 4,
+        "lost_state_replies": sum(worker["lost_state"] for worker in workers),
+        "upstream_calls": dict(app["stats"]),
+        "handling_s": round(max(worker["elapsed_s"] for worker in workers), 3),
+        "wall_s": round(elapsed, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--keywords", type=int, default=20)
+    parser.add_argument("--upstream-latency", type=float, default=0.02)
+    parser.add_argument("--backend", choices=["memory", "sqlite", "both"], default="both")
+    arguments = parser.parse_args()
+
+    for backend in (["memory", "sqlite"] if arguments.backend == "both" else [arguments.backend]):
+        arguments.backend = backend
+        print(json.dumps(run(arguments), ensure_ascii=False))
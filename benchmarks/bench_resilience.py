@@ -0,0 +1,165 @@
+"""在注入故障的本地模拟接口上验证重试、对冲请求和熔断的效果.
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/bench_resilience.py [--searches 300]
+
+场景：
+1. 上游 20% 请求返回 503：比较关闭/开启重试时的搜索成功率；
+2. 上游 5% 请求额外慢 1 秒：比较关闭/开启对冲请求时的 p50/p99 延迟；
+3. 上游完全宕机：熔断打开后，已缓存的关键词立即返回过期数据，未缓存的立即失败，上游请求数不再增长；
+   恢复后熔断器自动关闭。注意熔断器半开时只放行一个探测请求，探测完成前的其他请求仍会立即失败，
+   因此恢复阶段先单独发一次探测搜索，熔断器关闭后再并发搜索。
+
+结果不符合预期时（如本应成功的场景 ok 为 0、上游没有收到任何请求、熔断器没有打开或没有恢复），
+打印原因并以非零状态码退出，可以作为回归检查。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+from stub_api import start_stub  # noqa: E402
+from plugins.BiliSearchPlugin.main import BiliSearchPlugin, _CircuitBreaker, _UpstreamBusy  # noqa: E402
+
+
+FAILURES = []
+
+
+def check(condition: bool, message: str):
+    """记录不符合预期的结果，结束时统一报告."""
+    if not condition:
+        FAILURES.append(message)
+        print(f"  !! {message}")
+
+
+def make_plugin(base_url: str, **overrides) -> BiliSearchPlugin:
+    plugin = BiliSearchPlugin()
+    plugin.api_url = f"{base_url}/api.php"
+    plugin.search_cache_size = 0
+    for name, value in overrides.items():
+        setattr(plugin, name, value)
+    plugin._search_cache.maxsize = plugin.search_cache_size
+    plugin._search_cache.ttl = plugin.search_cache_ttl
+    plugin._breaker = _CircuitBreaker(plugin.circuit_failure_threshold, plugin.circuit_reset_timeout)
+    return plugin
+
+
+async def timed_searches(plugin: BiliSearchPlugin, keywords: list, concurrency: int = 20) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, ok, failed = [], 0, 0
+
+    async def one(keyword):
+        nonlocal ok, failed
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await plugin._search_video(keyword, "bench")
+            except _UpstreamBusy:
+                result = None
+            latencies.append(time.perf_counter() - start)
+            if result and result.get("data"):
+                ok += 1
+            else:
+                failed += 1
+
+    await asyncio.gather(*(one(keyword) for keyword in keywords))
+    latencies.sort()
+    return {
+        "ok": ok,
+        "failed": failed,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 1),
+    }
+
+
+async def scenario_errors(searches: int):
+    runner, base_url, app = await start_stub(error_rate=0.2)
+    try:
+        for attempts in (0, 2):
+            plugin = make_plugin(base_url, retry_attempts=attempts, retry_backoff=0.01, circuit_failure_threshold=10**6)
+            before = app["stats"]["search"]
+            result = await timed_searches(plugin, [f"错误{attempts}-{i}" for i in range(searches)])
+            await plugin._close_session()
+            print(f"[20% 错误] retry_attempts={attempts}: {result}，上游请求数: {app['stats']['search'] - before}")
+            check(app["stats"]["search"] > before, f"[20% 错误] retry_attempts={attempts}: 上游没有收到请求")
+            check(result["ok"] > 0, f"[20% 错误] retry_attempts={attempts}: 没有任何搜索成功")
+    finally:
+        await runner.cleanup()
+
+
+async def scenario_slow_tail(searches: int):
+    runner, base_url, app = await start_stub(latency=0.01, slow_rate=0.05, slow_latency=1.0)
+    try:
+        for hedge in (False, True):
+            plugin = make_plugin(base_url, hedge_enable=hedge, hedge_percentile=90)
+            await timed_searches(plugin, [f"预热{hedge}-{i}" for i in range(50)])  # 积累延迟样本
+            result = await timed_searches(plugin, [f"慢{hedge}-{i}" for i in range(searches)])
+            result["hedges"] = plugin.resilience_stats["hedges"]
+            await plugin._close_session()
+            print(f"[5% 慢请求] hedge_enable={hedge}: {result}")
+            check(result["ok"] > 0, f"[5% 慢请求] hedge_enable={hedge}: 没有任何搜索成功")
+    finally:
+        await runner.cleanup()
+
+
+async def scenario_outage(searches: int):
+    runner, base_url, app = await start_stub()
+    try:
+        plugin = make_plugin(
+            base_url,
+            search_cache_size=512,
+            search_cache_ttl=0.1,
+            retry_attempts=0,
+            circuit_failure_threshold=5,
+            circuit_reset_timeout=1.0,
+        )
+        warm = await plugin._search_video("热门番剧", "bench")
+        check(bool(warm and warm.get("data")), "[宕机] 预热搜索失败，上游没有正常返回")
+        await asyncio.sleep(0.2)  # 让缓存过期
+
+        app["faults"]["down"] = True
+        before = app["stats"]["search"]
+        cold = await timed_searches(plugin, [f"冷门{i}" for i in range(searches)])
+        stale = await timed_searches(plugin, ["热门番剧"] * searches)
+        print(f"[宕机] 未缓存关键词: {cold}")
+        print(f"[宕机] 已缓存关键词（返回过期数据）: {stale}")
+        outage_calls = app["stats"]["search"] - before
+        print(f"[宕机] 上游请求数: {outage_calls}，熔断状态: {plugin._breaker.state}")
+        check(outage_calls > 0, "[宕机] 上游没有收到请求，熔断器不可能被触发")
+        check(plugin._breaker.state == "open", f"[宕机] 熔断器没有打开（{plugin._breaker.state}）")
+        check(stale["ok"] == searches, f"[宕机] 已缓存关键词只有 {stale['ok']}/{searches} 返回了过期数据")
+
+        app["faults"]["down"] = False
+        await asyncio.sleep(plugin.circuit_reset_timeout)
+        # 半开状态只放行一个探测请求，先单独探测，熔断器关闭后再并发搜索
+        probe = await timed_searches(plugin, ["恢复探测"])
+        print(f"[恢复] 探测: {probe}，熔断状态: {plugin._breaker.state}")
+        check(probe["ok"] == 1 and plugin._breaker.state == "closed", "[恢复] 探测请求后熔断器没有关闭")
+        recovered = await timed_searches(plugin, [f"恢复{i}" for i in range(20)])
+        print(f"[恢复] {recovered}，熔断状态: {plugin._breaker.state}")
+        check(recovered["ok"] == 20, f"[恢复] 只有 {recovered['ok']}/20 次搜索成功")
+        await plugin._close_session()
+    finally:
+        await runner.cleanup()
+
+
+async def main(args):
+    await scenario_errors(args.searches)
+    await scenario_slow_tail(args.searches)
+    await scenario_outage(args.searches)
+    if FAILURES:
+        print(f"\n{len(FAILURES)} 项检查未通过:")
+        for message in FAILURES:
+            print(f"  - {message}")
+        sys.exit(1)
+    print("\n所有检查通过")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--searches", type=int, default=300)
+    asyncio.run(main(parser.parse_args()))
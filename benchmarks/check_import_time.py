@@ -0,0 +1,66 @@
+"""检查插件的冷启动导入耗时是否超出预算.
+
+用 `python -X importtime` 在新进程中导入插件，框架自身的模块会先行导入，
+只统计插件及其独有依赖的累计耗时。超出预算时以非零状态码退出，可以放进 CI。
+需要在机器人根目录下运行：
+    python plugins/BiliSearchPlugin/benchmarks/check_import_time.py [--budget-ms 30] [--runs 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+PLUGIN_MODULE = "plugins.BiliSearchPlugin.main"
+# 机器人框架启动时已经导入的模块，不计入插件的耗时
+FRAMEWORK_MODULES = ["aiohttp", "loguru", "tomllib", "WechatAPI", "database.XYBotDB", "utils.decorators", "utils.plugin_base"]
+
+
+def measure_once() -> tuple:
+    """在新进程中导入一次插件，返回 (插件累计耗时微秒, [(子模块累计耗时, 模块名)])."""
+    code = f"import {', '.join(FRAMEWORK_MODULES)}; import {PLUGIN_MODULE}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.getcwd(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # 模块名前每两个空格表示一层嵌套
+        entries.append((int(cumulative_us), depth, name.strip()))
+
+    # -X importtime 先输出子模块，再输出父模块；插件之前、缩进更深的条目都是插件带来的导入
+    for position, (cumulative, depth, module) in enumerate(entries):
+        if module == PLUGIN_MODULE:
+            children = []
+            for child_cumulative, child_depth, child in reversed(entries[:position]):
+                if child_depth <= depth:
+                    break
+                if child_depth == depth + 1:
+                    children.append((child_cumulative, child))
+            return cumulative, sorted(children, reverse=True)
+    raise RuntimeError(f"未在 importtime 输出中找到 {PLUGIN_MODULE}")
+
+
+def main(args) -> int:
+    runs = [measure_once() for _ in range(args.runs)]
+    best_us, children = min(runs, key=lambda run: run[0])
+    print(f"{PLUGIN_MODULE} 导入耗时（{args.runs} 次取最小值）：{best_us / 1000:.2f} ms，预算 {args.budget_ms:.2f} ms")
+    for cumulative, module in children[:10]:
+        print(f"  {cumulative / 1000:>8.2f} ms  {module}")
+    if best_us > args.budget_ms * 1000:
+        print("导入耗时超出预算，请检查是否新增了应延迟导入的依赖。")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=30.0)
+    parser.add_argument("--runs", type=int, default=5)
+    sys.exit(main(parser.parse_args()))
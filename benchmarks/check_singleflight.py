@@ -0,0 +1,83 @@
+"""检查合并请求（_SingleFlight）在等待方被取消时的行为.
+
+场景：预取是某个 list_url 唯一的等待方，预取被取消后共享的上游请求随之取消；
+在这个请求真正结束之前，另一个聊天请求同一个 list_url，应当发起新的请求并拿到结果，
+而不是加入正在取消的请求、收到 CancelledError 后被当作已取消的命令静默丢弃。
+同时检查还有其他等待方时，取消其中一个不会影响共享请求。不符合预期时以非零状态码退出。
+
+需要在机器人根目录下运行，以便导入插件：
+    python plugins/BiliSearchPlugin/benchmarks/check_singleflight.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+from plugins.BiliSearchPlugin.main import _SingleFlight  # noqa: E402
+
+
+async def check_cancel_then_join() -> list:
+    """预取被取消后立即加入同 key 的请求，应得到新请求的结果."""
+    flight = _SingleFlight(cancel_abandoned=True)
+    started = []
+
+    async def fetch():
+        started.append(len(started) + 1)
+        await asyncio.sleep(0.05)
+        return f"第 {len(started)} 次请求"
+
+    prefetch = asyncio.create_task(flight.do("list", fetch))
+    await asyncio.sleep(0)  # 让预取发起共享请求
+    prefetch.cancel()
+    try:
+        await prefetch
+    except asyncio.CancelledError:
+        pass
+    # 此时共享请求已被取消但尚未结束，紧接着到达的调用方不应加入它
+    problems = []
+    try:
+        result, shared = await flight.do("list", fetch)
+    except asyncio.CancelledError:
+        return ["预取被取消后，随后的请求加入了正在取消的共享请求并收到 CancelledError"]
+    if shared:
+        problems.append("预取被取消后，随后的请求仍被当作合并请求")
+    if len(started) != 2 or result != "第 2 次请求":
+        problems.append(f"预取被取消后，随后的请求没有发起新的上游请求（结果 {result!r}，请求次数 {len(started)}）")
+    return problems
+
+
+async def check_cancel_one_of_two() -> list:
+    """两个等待方中取消一个，另一个仍应拿到共享请求的结果."""
+    flight = _SingleFlight(cancel_abandoned=True)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    prefetch = asyncio.create_task(flight.do("list", fetch))
+    user = asyncio.create_task(flight.do("list", fetch))
+    await asyncio.sleep(0)
+    prefetch.cancel()
+    try:
+        result, shared = await user
+    except asyncio.CancelledError:
+        return ["取消预取时，同时在等待的用户请求也被取消了"]
+    if result != "ok" or not shared or calls != 1:
+        return [f"两个等待方没有共享同一个请求（结果 {result!r}，请求次数 {calls}）"]
+    return []
+
+
+async def main() -> int:
+    problems = await check_cancel_then_join() + await check_cancel_one_of_two()
+    for problem in problems:
+        print(f"  !! {problem}")
+    print("所有检查通过" if not problems else f"{len(problems)} 项检查未通过")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
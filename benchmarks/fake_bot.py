@@ -0,0 +1,38 @@
+"""模拟 WechatAPIClient，记录插件发出的消息，供基准测试使用."""
+
+import asyncio
+import time
+
+
+class FakeWechatClient:
+    """记录 send_text_message / send_app_message / send_image_message 调用的假客户端.
+
+    send_latency 模拟微信网关的发送耗时（秒）。
+    """
+
+    def __init__(self, wxid: str = "wxid_bench", send_latency: float = 0.0, keep_messages: bool = False):
+        self.wxid = wxid
+        self.send_latency = send_latency
+        self.keep_messages = keep_messages
+        self.messages = []  # keep_messages 为 True 时保存 (时间, 类型, chat_id, 内容)
+        self.counts = {"text": 0, "app": 0, "image": 0}
+
+    async def _record(self, kind: str, chat_id: str, content):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.counts[kind] += 1
+        if self.keep_messages:
+            self.messages.append((time.perf_counter(), kind, chat_id, content))
+
+    async def send_text_message(self, wxid: str, content: str, at=""):
+        await self._record("text", wxid, content)
+
+    async def send_app_message(self, wxid: str, xml: str, type: int):
+        await self._record("app", wxid, xml)
+
+    async def send_image_message(self, wxid: str, image):
+        await self._record("image", wxid, image)
+
+    def messages_for(self, chat_id: str) -> list:
+        """按发送顺序返回某个聊天收到的消息."""
+        return [message for message in self.messages if message[2] == chat_id]
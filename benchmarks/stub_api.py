@@ -0,0 +1,109 @@
+"""本地模拟上游接口，供基准测试使用.
+
+模拟 api.php 搜索接口（/api.php?msg=关键词）和 list_url 剧集接口（/list/<id>），
+返回结构与线上接口一致。
+"""
+
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+
+def _search_payload(base_url: str, keyword: str, results: int, description_size: int = 0) -> dict:
+    """构造搜索接口的返回数据，description_size 用于调整单条结果的大小."""
+    return {
+        "code": 200,
+        "data": [
+            {
+                "title": f"{keyword} 第{i + 1}部",
+                "cover": f"{base_url}/cover/{i + 1}.jpg",
+                "description": f"{keyword} 的简介 {i + 1}" + "简" * description_size,
+                "list_url": f"{base_url}/list/{i + 1}?msg={keyword}",
+            }
+            for i in range(results)
+        ],
+    }
+
+
+def _list_payload(base_url: str, list_id: str, episodes: int) -> dict:
+    """构造 list_url 剧集接口的返回数据."""
+    return {
+        "code": 200,
+        "data": [
+            {
+                "title": f"第{i + 1}集",
+                "mp4": f"{base_url}/video/{list_id}/{i + 1}.mp4",
+            }
+            for i in range(episodes)
+        ],
+    }
+
+
+def make_app(
+    latency: float = 0.0,
+    results: int = 20,
+    episodes: int = 24,
+    description_size: int = 0,
+    error_rate: float = 0.0,
+    slow_rate: float = 0.0,
+    slow_latency: float = 2.0,
+    seed: int = 0,
+) -> web.Application:
+    """创建模拟接口应用，并统计各接口的请求次数.
+
+    results / episodes / description_size 控制返回数据的大小（搜索结果条数、剧集数、每条简介追加的字符数）。
+    故障注入参数保存在 app["faults"] 中，运行期间可以修改（如设置 down=True 模拟上游宕机）：
+    error_rate 为返回 503 的比例，slow_rate 为额外等待 slow_latency 秒的比例。
+    """
+    app = web.Application()
+    app["stats"] = {"search": 0, "list": 0, "errors": 0, "slow": 0}
+    app["faults"] = {"error_rate": error_rate, "slow_rate": slow_rate, "slow_latency": slow_latency, "down": False}
+    rng = random.Random(seed)
+
+    def base_url(request: web.Request) -> str:
+        return f"{request.scheme}://{request.host}"
+
+    async def inject_faults() -> bool:
+        """按配置注入延迟和错误，返回 True 表示本次应返回错误."""
+        faults = app["faults"]
+        if latency:
+            await asyncio.sleep(latency)
+        if faults["slow_rate"] and rng.random() < faults["slow_rate"]:
+            app["stats"]["slow"] += 1
+            await asyncio.sleep(faults["slow_latency"])
+        if faults["down"] or (faults["error_rate"] and rng.random() < faults["error_rate"]):
+            app["stats"]["errors"] += 1
+            return True
+        return False
+
+    async def search(request: web.Request) -> web.Response:
+        app["stats"]["search"] += 1
+        if await inject_faults():
+            return web.Response(status=503, text="Service Unavailable")
+        payload = _search_payload(base_url(request), request.query.get("msg", ""), results, description_size)
+        return web.Response(text=json.dumps(payload, ensure_ascii=False), content_type="application/json")
+
+    async def episode_list(request: web.Request) -> web.Response:
+        app["stats"]["list"] += 1
+        if await inject_faults():
+            return web.Response(status=503, text="Service Unavailable")
+        payload = _list_payload(base_url(request), request.match_info["list_id"], episodes)
+        return web.Response(text=json.dumps(payload, ensure_ascii=False), content_type="application/json")
+
+    app.router.add_get("/api.php", search)
+    app.router.add_get("/list/{list_id}", episode_list)
+    return app
+
+
+async def start_stub(host: str = "127.0.0.1", port: int = 0, **options):
+    """启动模拟接口，返回 (runner, base_url, app)."""
+    app = make_app(**options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    sockets = site._server.sockets  # 端口为 0 时需要取实际监听的端口
+    actual_port = sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{actual_port}", app
@@ -1,26 +1,1545 @@
 import asyncio
+import bisect
+import codecs
+import contextlib
+import hashlib
 import json
+import math
+import os
+import random
 import re
+import sys
+import threading
 import tomllib
+import time
 import traceback
-from typing import List, Optional, Union
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
 import aiohttp
-import filetype
 from loguru import logger
-import speech_recognition as sr  # 导入speech_recognition
-import os
 from WechatAPI import WechatAPIClient
 from database.XYBotDB import XYBotDB
 from utils.decorators import *
 from utils.plugin_base import PluginBase
-import os
-import base64
-import asyncio
-import shutil
-from io import BytesIO
 
-from PIL import Image, ImageDraw, ImageFont  # 导入 PIL 库
+# 只在特定功能中用到的依赖（如 sqlite3）在使用时才导入，避免拖慢插件加载和热重载。
+# 加载耗时可用 benchmarks/check_import_time.py 检查。
+
+
+class _Histogram:
+    """固定分桶的耗时直方图（单位：秒）."""
+
+    __slots__ = ("counts", "count", "total")
+
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数，返回所在桶的上界."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.BOUNDS[-1]
+
+
+class _Timer:
+    """记录代码块耗时的上下文管理器."""
+
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: _Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _Metrics:
+    """插件内置指标：计数器、耗时直方图和按需读取的即时值.
+
+    可以通过 snapshot() 读取，也可以按配置在本地端口提供 Prometheus 文本格式，或定期写入日志。
+    """
+
+    def __init__(self, prefix: str = "bili_search"):
+        self.prefix = prefix
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, _Histogram] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._counter_reads: Dict[str, Callable[[], int]] = {}  # 由其他组件自行累计的计数器
+        self._runner = None
+        self._log_task: Optional[asyncio.Task] = None
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timer(self, name: str) -> _Timer:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = _Histogram()
+        return _Timer(histogram)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """注册一个即时值，读取指标时才调用 read."""
+        self._gauges[name] = read
+
+    def counter(self, name: str, read: Callable[[], int]):
+        """注册一个由其他组件累计、只增不减的计数器，读取指标时才调用 read."""
+        self._counter_reads[name] = read
+
+    def _all_counters(self) -> Dict[str, int]:
+        counters = dict(self.counters)
+        counters.update((name, read()) for name, read in self._counter_reads.items())
+        return counters
+
+    def snapshot(self) -> dict:
+        """返回所有指标的快照."""
+        return {
+            "counters": self._all_counters(),
+            "gauges": {name: read() for name, read in self._gauges.items()},
+            "latency": {
+                name: {
+                    "count": histogram.count,
+                    "avg_ms": round(histogram.total / histogram.count * 1000, 3) if histogram.count else 0.0,
+                    "p50_ms": histogram.quantile(0.5) * 1000,
+                    "p95_ms": histogram.quantile(0.95) * 1000,
+                    "p99_ms": histogram.quantile(0.99) * 1000,
+                }
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def prometheus_text(self) -> str:
+        """按 Prometheus 文本格式输出所有指标."""
+        def metric_name(name: str) -> str:
+            return f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+        lines = []
+        for name, value in self._all_counters().items():
+            lines.append(f"# TYPE {metric_name(name)}_total counter")
+            lines.append(f"{metric_name(name)}_total {value}")
+        for name, read in self._gauges.items():
+            lines.append(f"# TYPE {metric_name(name)} gauge")
+            lines.append(f"{metric_name(name)} {read()}")
+        for name, histogram in self.histograms.items():
+            full_name = f"{metric_name(name)}_seconds"
+            lines.append(f"# TYPE {full_name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.BOUNDS, histogram.counts):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{full_name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{full_name}_sum {histogram.total}")
+            lines.append(f"{full_name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def start(self, port: int, log_interval: float):
+        """按配置启动本地 Prometheus 接口和定期日志输出，port/log_interval 为 0 时不启动."""
+        if port and self._runner is None:
+            from aiohttp import web
+
+            async def handle(request):
+                return web.Response(text=self.prometheus_text(), content_type="text/plain")
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle)
+            runner = web.AppRunner(app)
+            try:
+                await runner.setup()
+                await web.TCPSite(runner, "127.0.0.1", port).start()
+                self._runner = runner
+                logger.info(f"BiliSearchPlugin 指标接口已启动: http://127.0.0.1:{port}/metrics")
+            except Exception as e:
+                await runner.cleanup()
+                logger.exception(f"BiliSearchPlugin 指标接口启动失败: {e}")
+        if log_interval and self._log_task is None:
+            self._log_task = asyncio.create_task(self._log_loop(log_interval))
+
+    async def _log_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"BiliSearchPlugin 指标: {json.dumps(self.snapshot(), ensure_ascii=False)}")
+
+    async def stop(self):
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class _TTLCache:
+    """带过期时间的 LRU 缓存，超过容量时淘汰最久未使用的条目."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key) -> Any:
+        """读取缓存，未命中或已过期时返回 None."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            return None  # 过期条目先保留，上游不可用时可用于兜底，由 LRU 淘汰
+        self._data.move_to_end(key)
+        return value
+
+    def get_stale(self, key) -> Any:
+        """读取缓存，忽略过期时间，用于上游不可用时兜底."""
+        item = self._data.get(key)
+        return None if item is None else item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        """写入缓存，并按 LRU 顺序淘汰超出容量的条目."""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class _SingleFlight:
+    """合并相同 key 的并发请求，同一时刻只有一个请求真正访问上游.
+
+    cancel_abandoned 为 True 时，所有等待方都被取消后同时取消共享的请求，不再占用上游。
+    """
+
+    def __init__(self, cancel_abandoned: bool = False):
+        self.cancel_abandoned = cancel_abandoned
+        self._tasks: Dict[Any, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}  # 共享请求 -> 等待方数量
+
+    async def do(self, key, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """执行或加入同 key 的请求，返回 (结果, 是否与其他请求合并)."""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield 保证某个等待方被取消时不会取消其他人共享的请求
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            remaining = self._waiters.pop(task) - 1
+            if remaining:
+                self._waiters[task] = remaining
+            elif self.cancel_abandoned and not task.done():
+                task.cancel()  # 没有等待方了（如预取被取消），请求结果已无人需要
+                # 任务要到下一轮事件循环才真正结束，先移除，之后的调用方发起新的请求而不是加入正在取消的任务
+                self._forget(key, task)
+
+    def _forget(self, key, task: asyncio.Future):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+class _UpstreamBusy(Exception):
+    """上游请求的等待队列已满."""
+
+    message = "当前使用的人太多啦，请稍后再试。"  # 回复给用户的提示
+
+
+class _UpstreamUnavailable(_UpstreamBusy):
+    """上游接口连续失败，熔断器处于打开状态."""
+
+    message = "视频接口暂时不可用，请稍后再试。"
+
+
+class _CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，期间请求立即失败；冷却后放行一个探测请求，成功则恢复."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """判断当前是否允许发送请求."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        # 探测请求被取消时不会回报结果，超时后允许重新探测
+        if self.state == "half_open" and (not self._probing or now - self._probe_started >= self.reset_timeout):
+            self._probing = True
+            self._probe_started = now
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                logger.warning(f"上游接口连续失败 {self._failures} 次，暂停请求 {self.reset_timeout} 秒")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class _LatencyWindow:
+    """记录最近若干次成功请求的耗时，用于计算对冲请求的等待阈值."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """返回耗时的百分位数，样本不足时返回 None."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class _UpstreamLimiter:
+    """上游请求调度器.
+
+    限制同时访问上游的请求数；超出时按聊天分别排队，放行时在各聊天之间轮流，
+    避免一个刷屏的群占满上游。等待队列有上限，排满时立即抛出 _UpstreamBusy。
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiting = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()  # 按轮转顺序排列的各聊天等待队列
+        self.stats = {"acquired": 0, "queued": 0, "rejected": 0, "max_depth": 0, "wait_total_s": 0.0, "wait_max_s": 0.0}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, chat_id: str):
+        """占用一个上游请求名额."""
+        await self._acquire(chat_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, chat_id: str):
+        if self._active < self.max_concurrency and not self._waiting:
+            self._active += 1
+            self.stats["acquired"] += 1
+            return
+        if self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise _UpstreamBusy()
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append(future)
+        self._waiting += 1
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._waiting)
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # 仍在排队时被取消，从队列中移除
+                queue = self._queues.get(chat_id)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    self._waiting -= 1
+                    if not queue:
+                        del self._queues[chat_id]
+            else:
+                # 已经拿到名额后才被取消，交还名额
+                self._release()
+            raise
+        waited = time.monotonic() - start
+        self.stats["acquired"] += 1  # 排队后真正拿到名额才计入，被拒绝或排队时被取消的不算
+        self.stats["wait_total_s"] += waited
+        self.stats["wait_max_s"] = max(self.stats["wait_max_s"], waited)
+
+    def _release(self):
+        # 名额直接交给下一个聊天的第一个等待者，该聊天随后排到轮转队尾
+        while self._queues:
+            chat_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(chat_id)
+            else:
+                del self._queues[chat_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def snapshot(self) -> dict:
+        """返回当前的调度统计."""
+        queued = self.stats["queued"]
+        return {
+            **self.stats,
+            "active": self._active,
+            "depth": self._waiting,
+            "waiting_chats": len(self._queues),
+            "wait_avg_s": self.stats["wait_total_s"] / queued if queued else 0.0,
+        }
+
+
+class _Prefetcher:
+    """在后台预先获取用户接下来很可能用到的数据.
+
+    同时进行的预取数量有上限，每分钟真正访问上游的次数不超过预算；
+    每个聊天同一时间只保留最新一批预取任务。
+    """
+
+    def __init__(
+        self,
+        warm: Callable[[str], Awaitable[Any]],
+        is_cached: Callable[[str], bool],
+        concurrency: int,
+        budget_per_minute: int,
+    ):
+        self._warm = warm
+        self._is_cached = is_cached
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.budget_per_minute = budget_per_minute
+        self._recent: deque = deque()  # 最近一分钟内访问上游的时间
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}
+        self.stats = {"scheduled": 0, "warmed": 0, "over_budget": 0, "cancelled": 0}
+
+    def schedule(self, chat_id: str, keys: List[str]):
+        """为聊天安排一批预取任务，同时取消该聊天之前尚未完成的预取."""
+        self.cancel(chat_id)
+        tasks = set()
+        for key in keys:
+            if key and not self._is_cached(key):
+                task = asyncio.create_task(self._run(key))
+                task.add_done_callback(lambda done: self._forget(chat_id, tasks, done))
+                tasks.add(task)
+        if tasks:
+            self._tasks[chat_id] = tasks
+            self.stats["scheduled"] += len(tasks)
+
+    def _forget(self, chat_id: str, tasks: Set[asyncio.Task], task: asyncio.Task):
+        tasks.discard(task)
+        if not tasks and self._tasks.get(chat_id) is tasks:
+            del self._tasks[chat_id]
+
+    def cancel(self, chat_id: str):
+        """取消聊天尚未完成的预取."""
+        for task in self._tasks.pop(chat_id, ()):
+            if task.cancel():
+                self.stats["cancelled"] += 1
+
+    def cancel_all(self):
+        for chat_id in list(self._tasks):
+            self.cancel(chat_id)
+
+    def _take_budget(self) -> bool:
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        if len(self._recent) >= self.budget_per_minute:
+            return False
+        self._recent.append(now)
+        return True
+
+    async def _run(self, key: str):
+        async with self._semaphore:
+            # 排队期间可能已被其他请求缓存
+            if self._is_cached(key):
+                return
+            if not self._take_budget():
+                self.stats["over_budget"] += 1
+                return
+            try:
+                await self._warm(key)
+            except _UpstreamBusy:
+                return  # 上游繁忙时放弃预取，不占用排队名额
+            self.stats["warmed"] += 1
+
+
+class _Outbox:
+    """按聊天排队的消息发送器.
+
+    同一聊天的消息按放入顺序逐条发送，不同聊天之间并发发送，同时发送的数量有上限。
+    处理函数把消息放入队列后即可返回，不用等待微信网关；带 supersede 标记的消息
+    （如翻页结果）尚未发出时，会被同一聊天中相同标记的新消息替换。
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_queue = max_queue  # 每个聊天最多排队的消息数
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues: Dict[str, deque] = {}  # chat_id -> [(发送函数, supersede 标记, 放入时间)]
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._depth = 0
+        self.delivery = _Histogram()  # 从放入队列到发送完成的耗时
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "superseded": 0, "dropped": 0, "max_depth": 0}
+
+    def put(self, chat_id: str, send: Callable[[], Awaitable[Any]], supersede: Optional[str] = None):
+        """把一条消息放入聊天的发送队列."""
+        queue = self._queues.setdefault(chat_id, deque())
+        if supersede is not None:
+            for item in queue:
+                if item[1] == supersede:
+                    queue.remove(item)
+                    self._depth -= 1
+                    self.stats["superseded"] += 1
+                    break
+        if len(queue) >= self.max_queue:
+            self.stats["dropped"] += 1
+            logger.warning(f"{chat_id} 的发送队列已满，丢弃一条消息")
+            return
+        queue.append((send, supersede, time.perf_counter()))
+        self._depth += 1
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._depth)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id, queue))
+
+    async def _drain(self, chat_id: str, queue: deque):
+        try:
+            while queue:
+                async with self._semaphore:
+                    # 等待名额期间，队首的消息可能已被替换，因此拿到名额后再取
+                    if not queue:
+                        break
+                    send, _, queued_at = queue.popleft()
+                    self._depth -= 1
+                    try:
+                        await send()
+                        self.stats["sent"] += 1
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        logger.exception(f"向 {chat_id} 发送消息失败: {e}")
+                    self.delivery.observe(time.perf_counter() - queued_at)
+        finally:
+            del self._workers[chat_id]
+            if self._queues.get(chat_id) is queue:
+                del self._queues[chat_id]
+            self._depth -= len(queue)
+
+    async def close(self, timeout: float):
+        """等待已排队的消息发送完成，超时后放弃剩余消息."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"发送队列关闭超时，{len(pending)} 个聊天的消息未发送完")
+
+    def snapshot(self) -> dict:
+        """返回当前的发送统计."""
+        return {
+            **self.stats,
+            "depth": self._depth,
+            "chats": len(self._queues),
+            "delivery_avg_s": self.delivery.total / self.delivery.count if self.delivery.count else 0.0,
+            "delivery_p95_s": self.delivery.quantile(0.95),
+        }
+
+
+class _ChatTurns:
+    """单个聊天的命令执行状态."""
+
+    __slots__ = ("lock", "seq", "latest", "users", "task", "running_kind", "running_seq")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # 等待者按到达顺序获得锁
+        self.seq = 0  # 最后收到的命令序号
+        self.latest: Dict[str, int] = {}  # 命令类型 -> 该类型最后一条命令的序号
+        self.users = 0  # 正在执行或排队的命令数，为 0 时删除
+        self.task: Optional[asyncio.Task] = None
+        self.running_kind: Optional[str] = None
+        self.running_seq: Optional[int] = None
+
+
+class _ChatCoordinator:
+    """按聊天协调命令的执行.
+
+    同一聊天的命令按消息到达顺序逐个执行，会话状态也按这个顺序更新。superseding 中的命令类型
+    （如搜索）收到新命令时，正在执行的旧命令被取消，排队中的旧命令直接跳过；
+    处理函数还可以通过 superseded() 判断后面是否已有同类命令，从而只渲染最后一次翻页。
+    """
+
+    def __init__(self, superseding: Set[str]):
+        self.superseding = superseding
+        self._chats: Dict[str, _ChatTurns] = {}
+        self.stats = {"cancelled": 0, "skipped": 0}
+
+    async def run(self, chat_id: str, kind: str, work: Callable[[], Awaitable[Any]], skipped_result: Any = False) -> Any:
+        """排队执行一条命令，命令被新命令取代时返回 skipped_result."""
+        turns = self._chats.get(chat_id)
+        if turns is None:
+            turns = self._chats[chat_id] = _ChatTurns()
+        turns.seq += 1
+        seq = turns.seq
+        turns.latest[kind] = seq
+        turns.users += 1
+        if kind in self.superseding and turns.running_kind == kind and turns.task is not None:
+            turns.task.cancel()
+            turns.task = None  # 已经取消，再来新的搜索时不重复计数
+            self.stats["cancelled"] += 1
+        try:
+            async with turns.lock:
+                if kind in self.superseding and turns.latest[kind] > seq:
+                    self.stats["skipped"] += 1
+                    return skipped_result
+                # 在单独的任务中执行，取消时只影响这条命令，不会取消框架调用插件的任务
+                task = asyncio.ensure_future(work())
+                turns.task, turns.running_kind, turns.running_seq = task, kind, seq
+                try:
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    turns.task = turns.running_kind = turns.running_seq = None
+                if task.cancelled():
+                    return skipped_result
+                return task.result()
+        finally:
+            turns.users -= 1
+            if not turns.users and self._chats.get(chat_id) is turns:
+                del self._chats[chat_id]
+
+    def superseded(self, chat_id: str, kind: str) -> bool:
+        """正在执行的命令之后是否已经收到了 kind 类型的命令."""
+        turns = self._chats.get(chat_id)
+        return turns is not None and turns.running_seq is not None and turns.latest.get(kind, 0) > turns.running_seq
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+
+class _Catalog:
+    """本地视频目录：记录搜索结果中出现过的视频，并按标题的二元组（bigram）建立倒排索引.
+
+    搜索过的关键词直接按上游当时返回的顺序回答；没搜索过的关键词只有在本地匹配到至少 min_results 个标题时才在本地回答，
+    避免只见过 “海贼王 剧场版” 时把搜索 “海贼王” 答成几个更窄的结果。匹配不够或命中的条目已过期时返回 None，由调用方回源刷新。
+    """
+
+    def __init__(self, max_entries: int, ttl: float, min_score: float, min_results: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_score = min_score  # 近似匹配时，关键词的二元组至少有这个比例出现在标题中
+        self.min_results = min_results  # 没搜索过的关键词至少匹配到这么多个标题才在本地回答
+        self._entries: "OrderedDict[str, Tuple[dict, str, float, int]]" = OrderedDict()  # list_url -> (视频, 规范化标题, 收录时间, 上游排序)
+        self._keywords: "OrderedDict[str, Tuple[Tuple[str, ...], float]]" = OrderedDict()  # 规范化关键词 -> (上游返回的 list_url 顺序, 收录时间)
+        self._index: Dict[str, Set[str]] = {}  # 二元组 -> list_url 集合
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evicted": 0}
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return "".join(text.split()).casefold()
+
+    @staticmethod
+    def _grams(text: str) -> Set[str]:
+        if len(text) < 2:
+            return {text} if text else set()
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, keyword: str, videos: List[dict]):
+        """收录关键词的搜索结果，已收录的视频会更新内容、收录时间和上游排序."""
+        now = time.monotonic()
+        urls = []
+        for position, video in enumerate(videos):
+            list_url, title = video.get("list_url"), video.get("title")
+            if not (list_url and isinstance(title, str)):
+                continue
+            self._remove(list_url)
+            normalized = self._normalize(title)
+            self._entries[list_url] = (video, normalized, now, position)
+            for gram in self._grams(normalized):
+                self._index.setdefault(gram, set()).add(list_url)
+            urls.append(list_url)
+        query = self._normalize(keyword)
+        self._keywords.pop(query, None)
+        if query and urls:
+            self._keywords[query] = (tuple(urls), now)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evicted"] += 1
+        while len(self._keywords) > self.max_entries:
+            self._keywords.popitem(last=False)
+
+    def _remove(self, list_url: str):
+        entry = self._entries.pop(list_url, None)
+        if entry is None:
+            return
+        for gram in self._grams(entry[1]):
+            urls = self._index.get(gram)
+            if urls is not None:
+                urls.discard(list_url)
+                if not urls:
+                    del self._index[gram]
+
+    def search(self, keyword: str, limit: int) -> Optional[List[dict]]:
+        """在本地目录中查找关键词，按完全匹配、前缀、包含、近似的顺序排序，同级按上游排序；无法可靠回答时返回 None."""
+        query = self._normalize(keyword)
+        if query in self._keywords:
+            return self._search_seen(query, limit)
+        grams = self._grams(query)
+        if not grams:
+            return None
+        # 达到 min_score 的标题至少包含 needed 个二元组，因此一定出现在最稀有的 len(grams) - needed + 1 个倒排表中
+        needed = max(1, math.ceil(self.min_score * len(grams)))
+        postings = sorted((self._index.get(gram, ()) for gram in grams), key=len)
+        candidates = set().union(*postings[:len(grams) - needed + 1])
+
+        now = time.monotonic()
+        ranked, stale = [], []
+        for list_url in candidates:
+            video, title, added_at, position = self._entries[list_url]
+            score = sum(gram in title for gram in grams) / len(grams)
+            if title == query:
+                rank = 3
+            elif title.startswith(query):
+                rank = 2
+            elif query in title:
+                rank = 1
+            elif score >= self.min_score:
+                rank = 0
+            else:
+                continue
+            if now - added_at > self.ttl:
+                stale.append(list_url)
+            ranked.append((-rank, -score, -added_at, position, list_url))  # 同一次搜索收录的结果保持上游顺序
+
+        if stale:
+            # 命中的条目过期时整体回源，过期条目先移除，回源结果会重新收录
+            for list_url in stale:
+                self._remove(list_url)
+            self.stats["stale"] += 1
+            return None
+        if len(ranked) < self.min_results:
+            self.stats["misses"] += 1  # 匹配太少时本地结果很可能只是上游结果的一小部分
+            return None
+        ranked.sort()
+        self.stats["hits"] += 1
+        results = []
+        for *_, list_url in ranked[:limit]:
+            self._entries.move_to_end(list_url)
+            results.append(self._entries[list_url][0])
+        return results
+
+    def _search_seen(self, query: str, limit: int) -> Optional[List[dict]]:
+        """搜索过的关键词按上游返回的顺序回答，过期或有视频已被淘汰时回源."""
+        urls, added_at = self._keywords[query]
+        if time.monotonic() - added_at > self.ttl or any(list_url not in self._entries for list_url in urls):
+            del self._keywords[query]
+            self.stats["stale"] += 1
+            return None
+        self._keywords.move_to_end(query)
+        self.stats["hits"] += 1
+        results = []
+        for list_url in urls[:limit]:
+            self._entries.move_to_end(list_url)
+            results.append(self._entries[list_url][0])
+        return results
+
+
+class _StateBackend:
+    """插件状态后端接口.
+
+    进程内的搜索缓存、剧集列表缓存和会话是一级缓存，后端位于它们之后：一级缓存未命中时按
+    (namespace, key) 读取，更新时写入。namespace 目前有 search、list、session、results 四种，value 需可以 JSON 序列化。
+    shared 为 True 的后端可以在重启后或多个进程之间共享数据。
+    """
+
+    shared = False
+
+    async def get(self, namespace: str, key: str) -> Any:
+        """读取数据，不存在或已过期时返回 None."""
+        return None
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float, urgent: bool = False):
+        """写入数据，urgent 为 True 时尽快写出，不等待下一次批量写入."""
+
+    async def flush(self):
+        """写出所有尚未写出的数据."""
+
+    async def close(self):
+        """写出剩余数据并释放资源."""
+
+
+class _MemoryBackend(_StateBackend):
+    """仅进程内的后端：状态只保存在本进程的缓存和会话中，不额外保存."""
+
+
+class _SqliteBackend(_StateBackend):
+    """基于 SQLite（WAL 模式）的后端，可跨重启保存，也可供同一台机器上的多个进程共享.
+
+    写入先放入内存队列，由后台任务批量写盘；同一轮事件循环中的多个读取合并成一次查询。
+    读写数据库都在线程池中执行，不阻塞事件循环；数据库在第一次读写时才打开，启动耗时与缓存大小无关。
+    """
+
+    shared = True
+    _MAX_VARIABLES = 500  # 单条 SQL 中 IN (...) 的参数个数上限
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._conn = None  # sqlite3.Connection，首次读写时创建
+        self._lock = threading.Lock()  # 串行化线程池中的数据库操作
+        self._pending: Dict[Tuple[str, str], Tuple[Any, float]] = {}  # 等待写盘的数据
+        self._writing: Dict[Tuple[str, str], Tuple[Any, float]] = {}  # 正在写盘的数据
+        self._wakeup = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._reads: Dict[Tuple[str, str], List[asyncio.Future]] = {}  # 等待合并查询的读取
+        self._read_task: Optional[asyncio.Task] = None
+        self.stats = {"reads": 0, "read_queries": 0, "writes": 0, "write_batches": 0}
+
+    def _connect(self):
+        """打开数据库并清理过期数据，需持有 _lock 调用."""
+        if self._conn is None:
+            import sqlite3  # 仅在使用 sqlite 后端时需要
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)  # 其他进程正在写入时最多等待 10 秒
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _read_many(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Any]:
+        by_namespace: Dict[str, List[str]] = {}
+        for namespace, key in keys:
+            by_namespace.setdefault(namespace, []).append(key)
+        result = {}
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            for namespace, names in by_namespace.items():
+                for start in range(0, len(names), self._MAX_VARIABLES):
+                    chunk = names[start:start + self._MAX_VARIABLES]
+                    rows = conn.execute(
+                        f"SELECT key, value FROM cache WHERE namespace = ? AND key IN ({', '.join('?' * len(chunk))}) AND expires_at > ?",
+                        (namespace, *chunk, now),
+                    ).fetchall()
+                    self.stats["read_queries"] += 1
+                    for key, value in rows:
+                        result[(namespace, key)] = json.loads(value)
+        return result
+
+    def _write(self, batch: Dict[Tuple[str, str], Tuple[Any, float]]):
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), expires_at) for (namespace, key), (value, expires_at) in batch.items()]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+            self.stats["writes"] += len(rows)
+            self.stats["write_batches"] += 1
+
+    def _close_conn(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _unflushed(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        return self._pending.get((namespace, key)) or self._writing.get((namespace, key))
+
+    async def get(self, namespace: str, key: str) -> Any:
+        """读取数据，优先返回尚未写盘的最新值；并发的读取合并成一次查询."""
+        item = self._unflushed(namespace, key)
+        if item is not None:
+            value, expires_at = item
+            return value if expires_at > time.time() else None
+        self.stats["reads"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._reads.setdefault((namespace, key), []).append(future)
+        if self._read_task is None:
+            self._read_task = asyncio.create_task(self._read_batch())
+        return await future
+
+    async def _read_batch(self):
+        await asyncio.sleep(0)  # 让同一轮事件循环中的其他读取加入本批
+        reads, self._reads = self._reads, {}
+        self._read_task = None
+        try:
+            values = await asyncio.to_thread(self._read_many, list(reads))
+        except Exception as e:
+            logger.warning(f"读取状态后端失败: {e}")
+            values = {}
+        for key, futures in reads.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(values.get(key))
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float, urgent: bool = False):
+        """写入数据（只进入队列，由后台任务写盘）."""
+        self._pending[(namespace, key)] = (value, time.time() + ttl)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if urgent or len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """把队列中的数据批量写盘."""
+        if not self._pending:
+            return
+        self._writing, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._write, self._writing)
+        except Exception as e:
+            logger.exception(f"写入状态后端失败: {e}")
+        finally:
+            self._writing = {}
+
+    async def close(self):
+        """停止后台任务，写入剩余数据并关闭数据库."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        await asyncio.to_thread(self._close_conn)
+
+
+class _EpisodeList:
+    """list_url 的解析结果：按列保存原始剧集名和播放链接，展示用的标题在翻页时才生成."""
+
+    __slots__ = ("raw_titles", "urls")
+
+    def __init__(self, raw_titles: Tuple[str, ...], urls: Tuple[str, ...]):
+        self.raw_titles = raw_titles  # 接口返回的剧集名
+        self.urls = urls  # 缺少播放链接的剧集为空字符串
+
+    def __len__(self) -> int:
+        return len(self.raw_titles)
+
+    def title(self, index: int) -> str:
+        """返回第 index 集（从 0 开始）的展示标题."""
+        return f"第{index + 1}集 {self.raw_titles[index]}".replace(f" {index + 1}", "")  # 添加剧集名字，并移除重复数字
+
+    def titles(self, start: int, stop: int) -> List[str]:
+        """返回 [start, stop) 范围内剧集的展示标题."""
+        return [self.title(index) for index in range(start, min(stop, len(self.raw_titles)))]
+
+    def to_dict(self) -> dict:
+        """转换为可以 JSON 序列化的字典，用于持久化."""
+        return {"raw_titles": list(self.raw_titles), "urls": list(self.urls)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "_EpisodeList":
+        return cls(tuple(data["raw_titles"]), tuple(data["urls"]))
+
+
+class _EpisodeListParser:
+    """增量解析 list_url 的返回数据，逐条解码 data 数组中的剧集，只保留 title 和 mp4.
+
+    响应体按块喂入，已解析的部分立即丢弃，不会同时持有完整的 JSON 文本和所有剧集字典。
+    """
+
+    _WHITESPACE = re.compile(r"[ \t\n\r]*")
+    _DELIMITERS = ",]} \t\n\r"  # 标量之后必须出现的字符，否则说明数据还没有接收完整
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self.raw_titles: List[str] = []
+        self.urls: List[str] = []
+        self.has_data = False  # 是否遇到了数组类型的 data 字段
+
+    def feed(self, chunk: bytes, final: bool = False):
+        """解析新到达的数据块，final 为 True 表示响应体已读完."""
+        self._buffer = self._buffer[self._pos:] + self._text.decode(chunk, final)
+        self._pos = 0
+        while self._step(final):
+            pass
+        if final and self._state != "done":
+            raise ValueError(f"剧集列表 JSON 不完整，解析停在 {self._state}")
+
+    def result(self) -> Optional["_EpisodeList"]:
+        """返回解析出的剧集列表，响应中没有 data 数组时返回 None."""
+        if not self.has_data:
+            return None
+        return _EpisodeList(tuple(self.raw_titles), tuple(self.urls))
+
+    def _skip_whitespace(self) -> bool:
+        """跳过空白字符，缓冲区中还有内容时返回 True."""
+        self._pos = self._WHITESPACE.match(self._buffer, self._pos).end()
+        return self._pos < len(self._buffer)
+
+    def _decode(self, final: bool):
+        """从当前位置解码一个完整的 JSON 值，数据还不完整时返回 (None, False)."""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None, False
+        if not final and self._buffer[self._pos] not in "\"{[" and not self._complete(self._buffer, end):
+            return None, False  # 数字、true 等标量可能还没有接收完整，如 "1." 会被解码成 1
+        self._pos = end
+        return value, True
+
+    def _complete(self, buffer: str, end: int) -> bool:
+        """标量解码结束的位置后面紧跟分隔符时才算完整，避免把被分块截断的 1.5e3 解析成 1."""
+        return end < len(buffer) and buffer[end] in self._DELIMITERS
+
+    def _expect(self, char: str):
+        if self._buffer[self._pos] != char:
+            raise ValueError(f"剧集列表 JSON 格式错误，位置 {self._pos} 处应为 {char!r}")
+        self._pos += 1
+
+    def _read_items(self, final: bool) -> bool:
+        """连续解码 data 数组中的剧集，读到数组末尾返回 True，需要更多数据时返回 False."""
+        buffer, pos, size = self._buffer, self._pos, len(self._buffer)
+        skip = self._WHITESPACE.match
+        decode = self._decoder.raw_decode
+        raw_titles, urls = self.raw_titles, self.urls
+        try:
+            while True:
+                pos = skip(buffer, pos).end()
+                if pos >= size:
+                    return False
+                char = buffer[pos]
+                if char == "]":
+                    pos += 1
+                    return True
+                if char == ",":
+                    pos += 1
+                    continue
+                try:
+                    item, end = decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    return False
+                if not final and char not in "\"{[" and not self._complete(buffer, end):
+                    return False
+                pos = end
+                if isinstance(item, dict):
+                    raw_titles.append(f"{item.get('title', '')}")
+                    urls.append(item.get("mp4") or "")
+                else:
+                    raw_titles.append("")
+                    urls.append("")
+        finally:
+            self._pos = pos
+
+    def _step(self, final: bool) -> bool:
+        """推进一步状态机，需要更多数据时返回 False."""
+        state = self._state
+        if state == "done" or not self._skip_whitespace():
+            return False
+        char = self._buffer[self._pos]
+        if state == "start":
+            self._expect("{")
+            self._state = "key"
+        elif state == "key":
+            if char == "}":
+                self._pos += 1
+                self._state = "done"
+                return False
+            if char == ",":
+                self._pos += 1
+                return True
+            key, ok = self._decode(final)
+            if not ok:
+                return False
+            self._key = key
+            self._state = "colon"
+        elif state == "colon":
+            self._expect(":")
+            self._state = "items_start" if self._key == "data" else "value"
+        elif state == "items_start":
+            if char != "[":
+                self._state = "value"
+                return True
+            self._pos += 1
+            self.has_data = True
+            self._state = "items"
+        elif state == "items":
+            if not self._read_items(final):
+                return False
+            self._state = "key"
+        elif state == "value":
+            _, ok = self._decode(final)  # 其他字段（code、msg 等）解码后直接丢弃
+            if not ok:
+                return False
+            self._state = "key"
+        return True
+
+
+async def _read_episode_list(response: aiohttp.ClientResponse) -> Optional["_EpisodeList"]:
+    """流式读取 list_url 的响应体并解析剧集列表."""
+    parser = _EpisodeListParser()
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        parser.feed(chunk)
+    parser.feed(b"", final=True)
+    return parser.result()
+
+
+_EMOJI_DIGITS = str.maketrans({str(digit): f"{digit}\ufe0f\u20e3" for digit in range(10)})  # 数字 -> Emoji 序号（如 1️⃣）
+
+
+class _PageRenderer:
+    """渲染搜索结果页和剧集页.
+
+    渲染结果按 (列表对象, 页) 缓存并在所有聊天间共享，翻阅同一部热门剧集时直接复用已渲染的文本。
+    """
+
+    def __init__(self, play_command: str, results_per_page: int, episodes_per_page: int, maxsize: int):
+        self.play_command = play_command
+        self.results_per_page = results_per_page
+        self.episodes_per_page = episodes_per_page
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[tuple, Tuple[Any, str]]" = OrderedDict()
+
+    @staticmethod
+    def number_emoji(num: int) -> str:
+        """将数字转换为对应的 Emoji 序号."""
+        return str(num).translate(_EMOJI_DIGITS)
+
+    def _cached(self, key: tuple, source, render: Callable[[], str]) -> str:
+        # key 中包含 id(source)，命中时还要确认是同一个对象，避免对象释放后 id 被复用
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] is source:
+            self._cache.move_to_end(key)
+            return entry[1]
+        text = render()
+        if self.maxsize > 0:
+            self._cache[key] = (source, text)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return text
+
+    def search_page(self, video_list: List[dict], page: int) -> str:
+        """渲染搜索结果的第 page 页（从 1 开始）."""
+        return self._cached(("search", id(video_list), page), video_list, lambda: self._render_search(video_list, page))
+
+    def episode_page(self, title: str, episodes: "_EpisodeList", start_index: int) -> str:
+        """渲染从 start_index 开始的一页剧集."""
+        return self._cached(
+            ("episodes", id(episodes), title, start_index),
+            episodes,
+            lambda: self._render_episodes(title, episodes, start_index),
+        )
+
+    def _render_search(self, video_list: List[dict], page: int) -> str:
+        total_pages = (len(video_list) + self.results_per_page - 1) // self.results_per_page
+        start_index = (page - 1) * self.results_per_page
+        display_list = video_list[start_index:start_index + self.results_per_page]
+        lines = ["🎬———B站视频———🎬"]
+        lines.extend(f"{self.number_emoji(start_index + i + 1)}. {video['title']}🎞️" for i, video in enumerate(display_list))
+        lines.append("_________________________")
+        lines.append(f"🎵输入 “{self.play_command.strip()}+序号” 选择视频🎵")
+        lines.append(f"当前：{page}/{total_pages}页, 输入 “下一页” “上一页” “最后一页”")
+        return "\n".join(lines)
+
+    def _render_episodes(self, title: str, episodes: "_EpisodeList", start_index: int) -> str:
+        total_pages = (len(episodes) + self.episodes_per_page - 1) // self.episodes_per_page
+        current_page = (start_index // self.episodes_per_page) + 1
+        display_list = episodes.titles(start_index, start_index + self.episodes_per_page)  # 只格式化当前页的标题
+        lines = [f"🎬———{title} ———🎬"]
+        lines.extend(f"{self.number_emoji(start_index + i + 1)}. {episode}" for i, episode in enumerate(display_list))
+        lines.append(f"       🎞️{self.number_emoji(current_page)}/{self.number_emoji(total_pages)}🎞️")
+        lines.append("_________________________")
+        lines.append("🎵输入 “序号 + 数字” 选择剧集🎵")
+        lines.append("🎵输入 “下一页” “上一页” “最后一页”🎵")
+        return "\n".join(lines)
+
+
+def _render_contact_sheet(covers: List[Optional[bytes]], first_number: int, columns: int, thumb_width: int) -> bytes:
+    """把封面拼成一张带序号的图片，返回 JPEG 数据.
+
+    在进程池中运行，Pillow 只在这里导入；封面缺失或损坏时用灰色占位。
+    """
+    import io
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+    thumb_height = thumb_width * 9 // 16  # B站封面为 16:9
+    gap = 8
+    rows = (len(covers) + columns - 1) // columns
+    sheet = Image.new("RGB", (gap + columns * (thumb_width + gap), gap + rows * (thumb_height + gap)), (245, 245, 245))
+    draw = ImageDraw.Draw(sheet)
+    try:
+        font = ImageFont.load_default(size=thumb_height // 4)
+    except TypeError:  # Pillow 10.1 之前的默认字体不支持指定大小
+        font = ImageFont.load_default()
+
+    for i, data in enumerate(covers):
+        x = gap + (i % columns) * (thumb_width + gap)
+        y = gap + (i // columns) * (thumb_height + gap)
+        thumb = None
+        if data:
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    thumb = ImageOps.fit(image.convert("RGB"), (thumb_width, thumb_height))
+            except Exception:
+                thumb = None
+        if thumb is not None:
+            sheet.paste(thumb, (x, y))
+        else:
+            draw.rectangle((x, y, x + thumb_width - 1, y + thumb_height - 1), fill=(200, 200, 200))
+        label = str(first_number + i)
+        left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+        draw.rectangle((x, y, x + right - left + 12, y + bottom - top + 10), fill=(251, 114, 153))
+        draw.text((x + 6 - left, y + 5 - top), label, font=font, fill=(255, 255, 255))
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class _ByteCache:
+    """按总字节数限制大小的 LRU 缓存."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.nbytes -= len(old)
+        self._data[key] = value
+        self.nbytes += len(value)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.nbytes -= len(evicted)
+
+
+class _ContactSheets:
+    """为搜索结果页生成封面拼图.
+
+    封面并发下载，按内容哈希缓存；拼图在大小有限的进程池中生成，不阻塞事件循环，
+    结果按所用封面的内容哈希缓存。进程池在第一次生成拼图时才创建。
+    """
+
+    _MAX_COVER_URLS = 10000  # 最多记录的封面 URL -> 内容哈希映射数量
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Optional[bytes]]],
+        workers: int,
+        columns: int,
+        thumb_width: int,
+        fetch_concurrency: int,
+        cover_cache_bytes: int,
+        sheet_cache_bytes: int,
+    ):
+        self._fetch = fetch
+        self.workers = workers
+        self.columns = columns
+        self.thumb_width = thumb_width
+        self._fetch_semaphore = asyncio.Semaphore(fetch_concurrency)
+        self._render_slots = asyncio.Semaphore(workers * 2)  # 限制提交到进程池的任务数，避免积压
+        self._pool = None  # ProcessPoolExecutor
+        self._covers = _ByteCache(cover_cache_bytes)  # 内容哈希 -> 封面数据
+        self._cover_hashes: "OrderedDict[str, str]" = OrderedDict()  # 封面 URL -> 内容哈希
+        self._cover_flight = _SingleFlight()
+        self._sheets = _ByteCache(sheet_cache_bytes)
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self.stats = {"sheet_hits": 0, "rendered": 0, "cover_hits": 0, "cover_fetched": 0, "cover_failed": 0}
+
+    async def _cover(self, url: str) -> Optional[Tuple[str, bytes]]:
+        """返回封面的 (内容哈希, 数据)，需要时下载；数据随哈希一起返回，不会在生成拼图前被缓存淘汰."""
+        if not url:
+            return None
+        digest = self._cover_hashes.get(url)
+        if digest is not None:
+            data = self._covers.get(digest)
+            if data is not None:
+                self._cover_hashes.move_to_end(url)
+                self.stats["cover_hits"] += 1
+                return digest, data
+        cover, _ = await self._cover_flight.do(url, lambda: self._download(url))
+        return cover
+
+    async def _download(self, url: str) -> Optional[Tuple[str, bytes]]:
+        async with self._fetch_semaphore:
+            data = await self._fetch(url)
+        if not data:
+            self.stats["cover_failed"] += 1
+            return None
+        self.stats["cover_fetched"] += 1
+        digest = hashlib.sha1(data).hexdigest()
+        self._covers.set(digest, data)
+        self._cover_hashes[url] = digest
+        self._cover_hashes.move_to_end(url)
+        while len(self._cover_hashes) > self._MAX_COVER_URLS:
+            self._cover_hashes.popitem(last=False)
+        return digest, data
+
+    async def render(self, videos: List[dict], first_number: int) -> Optional[bytes]:
+        """生成一页搜索结果的封面拼图，没有任何可用封面时返回 None."""
+        results = await asyncio.gather(*(self._cover(video.get("cover") or "") for video in videos))
+        if not any(results):
+            return None
+        key = hashlib.sha1(
+            f"{first_number}|{self.columns}|{self.thumb_width}|{'|'.join(cover[0] if cover else '-' for cover in results)}".encode()
+        ).hexdigest()
+        sheet = self._sheets.get(key)
+        if sheet is not None:
+            self.stats["sheet_hits"] += 1
+            return sheet
+        future = self._rendering.get(key)
+        if future is None:
+            covers = [cover[1] if cover else None for cover in results]
+            future = asyncio.ensure_future(self._render(key, covers, first_number))
+            self._rendering[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        # 等待方超时放弃时，拼图仍会生成并缓存，供下一次使用
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, future: asyncio.Future):
+        self._rendering.pop(key, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"生成封面拼图失败: {future.exception()}")
+
+    async def _render(self, key: str, covers: List[Optional[bytes]], first_number: int) -> bytes:
+        from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+
+        async with self._render_slots:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                sheet = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, _render_contact_sheet, covers, first_number, self.columns, self.thumb_width
+                )
+            except BrokenProcessPool:
+                self._pool = None  # 子进程异常退出后，下次重新创建进程池
+                raise
+        self._sheets.set(key, sheet)
+        self.stats["rendered"] += 1
+        return sheet
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _approx_size(obj) -> int:
+    """粗略估算对象及其直接包含的元素占用的字节数."""
+    if isinstance(obj, _EpisodeList):
+        return sys.getsizeof(obj) + _approx_size(obj.raw_titles) + _approx_size(obj.urls)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sys.getsizeof(value) for value in obj.values())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_approx_size(item) if isinstance(item, dict) else sys.getsizeof(item) for item in obj)
+    return size
+
+
+class _ChatSession:
+    """单个聊天的搜索与剧集状态，列表字段均引用共享缓存，不单独复制."""
+
+    __slots__ = ("keyword", "video_list", "current_page", "video_index", "episodes", "start_index", "last_active", "updated_at", "nbytes")
+
+    def __init__(self):
+        self.keyword: str = ""
+        self.video_list: List[dict] = []  # 搜索结果列表
+        self.current_page: int = 1  # 搜索结果当前页
+        self.video_index: Optional[int] = None  # 当前选择的视频序号（从 1 开始）
+        self.episodes: Optional[_EpisodeList] = None  # 当前视频的剧集列表
+        self.start_index: int = 0  # 当前剧集页的起始下标
+        self.last_active: float = 0.0
+        self.updated_at: float = 0.0  # 最后一次保存的时间（time.time()），用于多进程间比较新旧
+        self.nbytes: int = 0  # 会话自身占用的字节数，不含共享列表
+
+    def estimate_size(self) -> int:
+        """估算会话自身占用的字节数."""
+        return sys.getsizeof(self) + sys.getsizeof(self.keyword)
+
+
+class _SessionStore:
+    """按聊天保存会话，支持空闲过期，并在超出数量或内存上限时淘汰最久未活动的会话.
+
+    内存上限同时计入会话引用的搜索结果和剧集列表：共享缓存淘汰这些列表后，只有会话还让它们留在内存中。
+    同一个列表对象被多个会话引用时只计算一次。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, idle_ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, _ChatSession]" = OrderedDict()
+        self._bytes = 0
+        self._lists: Dict[str, Tuple[Any, ...]] = {}  # chat_id -> 会话保存时引用的列表对象
+        self._shared: Dict[int, List[Any]] = {}  # id(列表) -> [列表, 引用它的会话数, 字节数]
+        self._shared_bytes = 0
+
+    def get(self, chat_id: str) -> Optional[_ChatSession]:
+        """获取会话，不存在或已过期时返回 None."""
+        session = self._sessions.get(chat_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_active > self.idle_ttl:
+            self.pop(chat_id)
+            return None
+        session.last_active = now
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def get_or_create(self, chat_id: str) -> _ChatSession:
+        """获取会话，不存在时创建一个新会话（需调用 save 保存）."""
+        session = self.get(chat_id)
+        return session if session is not None else _ChatSession()
+
+    def save(self, chat_id: str, session: _ChatSession):
+        """保存修改后的会话，并按需淘汰旧会话."""
+        old = self._sessions.pop(chat_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        session.last_active = time.monotonic()
+        session.nbytes = session.estimate_size()
+        self._sessions[chat_id] = session
+        self._bytes += session.nbytes
+        # 先引用新的列表再释放旧的，列表没有变化时不用重新估算大小
+        lists = tuple(obj for obj in (session.video_list, session.episodes) if obj)
+        for obj in lists:
+            self._retain(obj)
+        for obj in self._lists.pop(chat_id, ()):
+            self._release(obj)
+        if lists:
+            self._lists[chat_id] = lists
+        self._evict()
+
+    def pop(self, chat_id: str) -> Optional[_ChatSession]:
+        """移除会话."""
+        session = self._sessions.pop(chat_id, None)
+        if session is not None:
+            self._bytes -= session.nbytes
+        for obj in self._lists.pop(chat_id, ()):
+            self._release(obj)
+        return session
+
+    def _retain(self, obj):
+        entry = self._shared.get(id(obj))
+        if entry is None:
+            entry = self._shared[id(obj)] = [obj, 0, _approx_size(obj)]
+            self._shared_bytes += entry[2]
+        entry[1] += 1
+
+    def _release(self, obj):
+        entry = self._shared[id(obj)]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._shared[id(obj)]
+            self._shared_bytes -= entry[2]
+
+    def _evict(self):
+        """从最久未活动的会话开始，淘汰过期或超出上限的会话."""
+        now = time.monotonic()
+        while self._sessions:
+            chat_id, oldest = next(iter(self._sessions.items()))
+            if (
+                len(self._sessions) > self.max_entries
+                or (self._bytes + self._shared_bytes > self.max_bytes and len(self._sessions) > 1)  # 刚保存的会话不因内存上限被淘汰
+                or now - oldest.last_active > self.idle_ttl
+            ):
+                self.pop(chat_id)
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def session_bytes(self) -> int:
+        """会话自身占用的字节数，不含共享列表."""
+        return self._bytes
+
+    @property
+    def shared_bytes(self) -> int:
+        """会话引用的列表占用的字节数，同一个列表只计算一次."""
+        return self._shared_bytes
+
+    def memory_usage(self) -> dict:
+        """统计会话占用的内存，共享的列表按对象去重后单独计算."""
+        return {
+            "sessions": len(self._sessions),
+            "session_bytes": self._bytes,
+            "shared_objects": len(self._shared),
+            "shared_bytes": self._shared_bytes,
+            "total_bytes": self._bytes + self._shared_bytes,
+        }
 
 
 class BiliSearchPlugin(PluginBase):
@@ -39,13 +1558,164 @@ class BiliSearchPlugin(PluginBase):
         self.commands = self.config.get("commands", ["B站"])  # 修改为 B站
         self.api_url = self.config.get("api_url", "")
         self.play_command = self.config.get("play_command", "视频 ")
-        self.search_results = {}  # 用于存储搜索结果，格式为 {chat_id: {keyword: [video_list]}}
-        self.episode_results = {}  # 用于存储剧集结果，格式为 {chat_id: {video_index: [episode_list], start_index: int}}
-        self.current_video_index = {}  # 用于记录当前用户选择的视频索引
         self.LIST_URL_KEY = "list_url"  # 定义 list_url 的 key 为常量
         self.RESULTS_PER_PAGE = 20  # 每页显示的结果数量
         self.PAGE_COMMANDS = ["第", "页", "上一页", "下一页", "最后一页"]  # 分页命令
+        self._command_pattern = self._build_command_pattern()  # 加载时编译一次，快速过滤无关消息
+        self._command_routes = {
+            "play": self._handle_play_command,
+            "select": self._handle_episode_selection,
+            "navigate": self._handle_episode_navigation,
+            "search": self._handle_search_command,
+            "episode": self._handle_episode_shortcut,
+        }
+        self._coordinator = _ChatCoordinator({"search"})  # 同一聊天的命令按顺序执行，新的搜索取代旧的搜索
         self.EPISODES_PER_BATCH = 20  # 每次发送的剧集数量
+        self.render_cache_size = self.config.get("render_cache_size", 1024)  # 最多缓存的已渲染页面数量
+        self._renderer = _PageRenderer(self.play_command, self.RESULTS_PER_PAGE, self.EPISODES_PER_BATCH, self.render_cache_size)
+
+        # 指标配置
+        self.metrics_port = self.config.get("metrics_port", 0)  # 本地 Prometheus 指标端口，0 表示不启动
+        self.metrics_log_interval = self.config.get("metrics_log_interval", 0)  # 定期把指标写入日志的间隔（秒），0 表示不输出
+        self.metrics = _Metrics()
+        self.metrics.gauge("search_cache_size", lambda: len(self._search_cache))
+        self.metrics.counter("search_cache_hits", lambda: self.search_cache_stats["hits"])
+        self.metrics.counter("search_cache_misses", lambda: self.search_cache_stats["misses"])
+        self.metrics.counter("search_cache_coalesced", lambda: self.search_cache_stats["coalesced"])
+        self.metrics.gauge("list_cache_size", lambda: len(self._list_cache))
+        self.metrics.gauge("sessions", lambda: len(self.sessions))
+        self.metrics.gauge("session_bytes", lambda: self.sessions.session_bytes)
+        self.metrics.gauge("session_shared_bytes", lambda: self.sessions.shared_bytes)
+        self.metrics.gauge("upstream_active", lambda: self._limiter.snapshot()["active"])
+        self.metrics.gauge("upstream_queue_depth", lambda: self._limiter.snapshot()["depth"])
+        self.metrics.gauge("upstream_circuit_open", lambda: int(self._breaker.state != "closed"))
+        self.metrics.gauge("catalog_size", lambda: len(self._catalog) if self._catalog is not None else 0)
+        self.metrics.gauge("busy_chats", lambda: len(self._coordinator))
+        self.metrics.counter("commands_cancelled", lambda: self._coordinator.stats["cancelled"])
+        self.metrics.counter("commands_skipped", lambda: self._coordinator.stats["skipped"])
+        self.metrics.gauge("outbox_depth", lambda: self._outbox.snapshot()["depth"] if self._outbox is not None else 0)
+
+        # HTTP 连接池配置
+        self.http_limit = self.config.get("http_limit", 100)  # 连接池总连接数上限
+        self.http_limit_per_host = self.config.get("http_limit_per_host", 20)  # 每个主机的连接数上限
+        self.http_keepalive_timeout = self.config.get("http_keepalive_timeout", 30)  # 空闲连接保活时间（秒）
+        self.http_dns_cache_ttl = self.config.get("http_dns_cache_ttl", 300)  # DNS 缓存时间（秒）
+        self.http_connect_timeout = self.config.get("http_connect_timeout", 5)  # 建立连接超时（秒）
+        self.http_read_timeout = self.config.get("http_read_timeout", 10)  # 读取响应超时（秒）
+        self.http_total_timeout = self.config.get("http_total_timeout", 10)  # 单次请求的总超时（秒），0 表示不限制
+        self._session: Optional[aiohttp.ClientSession] = None  # 共享的 HTTP 会话，首次请求时创建
+
+        # 上游请求调度配置
+        self.upstream_max_concurrency = self.config.get("upstream_max_concurrency", 16)  # 同时访问上游的请求数上限
+        self.upstream_max_queue = self.config.get("upstream_max_queue", 200)  # 排队等待的请求数上限，超出时直接提示繁忙
+        self._limiter = _UpstreamLimiter(self.upstream_max_concurrency, self.upstream_max_queue)
+
+        # 上游容错配置
+        self.retry_attempts = self.config.get("retry_attempts", 2)  # 网络错误或 5xx 时的重试次数
+        self.retry_backoff = self.config.get("retry_backoff", 0.2)  # 重试退避基数（秒），实际等待为随机抖动后的指数退避
+        self.retry_deadline = self.config.get("retry_deadline", 10)  # 一次上游调用所有尝试共用的期限（秒），0 表示不限制
+        self.hedge_enable = self.config.get("hedge_enable", False)  # 慢请求是否发送对冲请求
+        self.hedge_percentile = self.config.get("hedge_percentile", 95)  # 请求耗时超过近期该百分位时发送对冲请求
+        self.circuit_failure_threshold = self.config.get("circuit_failure_threshold", 5)  # 连续失败多少次后熔断
+        self.circuit_reset_timeout = self.config.get("circuit_reset_timeout", 30)  # 熔断后多少秒再尝试恢复
+        self._breaker = _CircuitBreaker(self.circuit_failure_threshold, self.circuit_reset_timeout)
+        self._latency = _LatencyWindow()
+        self.resilience_stats = {"retries": 0, "hedges": 0, "deadline_exceeded": 0}
+
+        # 搜索结果缓存配置
+        self.search_cache_ttl = self.config.get("search_cache_ttl", 600)  # 搜索结果缓存时间（秒）
+        self.search_cache_size = self.config.get("search_cache_size", 512)  # 最多缓存的关键词数量
+        self._search_cache = _TTLCache(self.search_cache_size, self.search_cache_ttl)
+        self._search_flight = _SingleFlight()
+        self.search_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}  # 搜索缓存命中/未命中/合并请求计数
+
+        # 剧集列表缓存配置
+        self.list_cache_ttl = self.config.get("list_cache_ttl", 1800)  # 剧集列表缓存时间（秒）
+        self.list_cache_size = self.config.get("list_cache_size", 256)  # 最多缓存的剧集列表数量
+        self._list_cache = _TTLCache(self.list_cache_size, self.list_cache_ttl)
+        self._list_flight = _SingleFlight(cancel_abandoned=True)  # 预取被取消时一并取消它发起的上游请求
+
+        # 会话存储配置
+        self.session_idle_ttl = self.config.get("session_idle_ttl", 3600)  # 会话空闲过期时间（秒）
+        self.session_max_entries = self.config.get("session_max_entries", 10000)  # 最多保存的会话数量
+        self.session_max_bytes = self.config.get("session_max_bytes", 16 * 1024 * 1024)  # 会话及其引用的列表占用内存上限（字节）
+        self.sessions = _SessionStore(self.session_max_entries, self.session_max_bytes, self.session_idle_ttl)  # 每个聊天的搜索与剧集状态
+
+        # 状态后端配置
+        self.state_backend = self.config.get("state_backend", "sqlite" if self.config.get("persist_enable") else "memory")  # memory：仅进程内；sqlite：保存到 persist_path
+        self.state_multi_process = self.config.get("state_multi_process", False)  # 多个进程共用 sqlite 后端时开启，每条消息都与共享的会话核对
+        self.persist_path = self.config.get("persist_path", "plugins/BiliSearchPlugin/cache.db")  # SQLite 数据库路径
+        self.persist_flush_interval = self.config.get("persist_flush_interval", 2)  # 批量写盘间隔（秒）
+        self.persist_batch_size = self.config.get("persist_batch_size", 200)  # 队列达到该数量时立即写盘
+        if self.state_backend == "sqlite":
+            self._backend: _StateBackend = _SqliteBackend(self.persist_path, self.persist_flush_interval, self.persist_batch_size)
+        else:
+            if self.state_backend != "memory":
+                logger.warning(f"未知的 state_backend: {self.state_backend}，使用 memory")
+            self._backend = _MemoryBackend()
+
+        # 预取配置
+        self.prefetch_enable = self.config.get("prefetch_enable", False)  # 是否在后台预取剧集列表
+        self.prefetch_top_k = self.config.get("prefetch_top_k", 3)  # 搜索后预取前几个结果的剧集列表
+        self.prefetch_concurrency = self.config.get("prefetch_concurrency", 2)  # 同时进行的预取数量
+        self.prefetch_budget_per_minute = self.config.get("prefetch_budget_per_minute", 30)  # 每分钟预取访问上游的次数上限
+        self._prefetcher = (
+            _Prefetcher(
+                self._resolve_list,
+                lambda list_url: self._list_cache.get(list_url) is not None,
+                self.prefetch_concurrency,
+                self.prefetch_budget_per_minute,
+            )
+            if self.prefetch_enable
+            else None
+        )
+
+        # 本地视频目录配置
+        self.catalog_enable = self.config.get("catalog_enable", False)  # 是否用见过的搜索结果在本地回答搜索
+        self.catalog_max_entries = self.config.get("catalog_max_entries", 5000)  # 目录最多收录的视频数量
+        self.catalog_ttl = self.config.get("catalog_ttl", 1800)  # 目录条目的有效期（秒），过期后回源刷新
+        self.catalog_min_score = self.config.get("catalog_min_score", 0.8)  # 近似匹配的最低匹配度（0~1），低于该值时回源
+        self.catalog_max_results = self.config.get("catalog_max_results", 20)  # 本地回答时最多返回的结果数
+        self.catalog_min_results = self.config.get("catalog_min_results", 10)  # 没搜索过的关键词至少匹配到这么多个结果才在本地回答
+        self._catalog = (
+            _Catalog(self.catalog_max_entries, self.catalog_ttl, self.catalog_min_score, self.catalog_min_results)
+            if self.catalog_enable
+            else None
+        )
+
+        # 发送队列配置
+        self.outbox_max_concurrency = self.config.get("outbox_max_concurrency", 8)  # 同时发送消息的聊天数上限，0 表示在处理函数中直接发送
+        self.outbox_max_queue = self.config.get("outbox_max_queue", 50)  # 每个聊天最多排队的消息数
+        self.outbox_close_timeout = self.config.get("outbox_close_timeout", 5)  # 插件禁用时等待队列发送完成的时间（秒）
+        self._outbox = _Outbox(self.outbox_max_concurrency, self.outbox_max_queue) if self.outbox_max_concurrency > 0 else None
+        if self._outbox is not None:
+            self.metrics.histograms["outbox.delivery"] = self._outbox.delivery
+
+        # 图片模式配置
+        self.image_mode_enable = self.config.get("image_mode_enable", False)  # 搜索结果是否额外发送一张封面拼图（需要 Pillow）
+        self.image_render_budget = self.config.get("image_render_budget", 2.0)  # 生成拼图的时间上限（秒），超出时只发文字
+        self.image_workers = self.config.get("image_workers", 2)  # 生成拼图的进程数
+        self.image_columns = self.config.get("image_columns", 4)  # 拼图每行的封面数
+        self.image_thumb_width = self.config.get("image_thumb_width", 240)  # 每张封面缩略图的宽度（像素）
+        self.image_fetch_concurrency = self.config.get("image_fetch_concurrency", 8)  # 同时下载的封面数
+        self.image_cover_cache_bytes = self.config.get("image_cover_cache_bytes", 32 * 1024 * 1024)  # 封面缓存上限（字节）
+        self.image_sheet_cache_bytes = self.config.get("image_sheet_cache_bytes", 16 * 1024 * 1024)  # 拼图缓存上限（字节）
+        self._sheets: Optional[_ContactSheets] = None
+        if self.image_mode_enable:
+            from importlib.util import find_spec
+
+            if find_spec("PIL") is None:
+                logger.warning("BiliSearchPlugin 图片模式需要 Pillow（pip install Pillow），已改为只发送文字")
+            else:
+                self._sheets = _ContactSheets(
+                    self._fetch_cover,
+                    self.image_workers,
+                    self.image_columns,
+                    self.image_thumb_width,
+                    self.image_fetch_concurrency,
+                    self.image_cover_cache_bytes,
+                    self.image_sheet_cache_bytes,
+                )
 
     def _load_config(self):
         """加载插件配置."""
@@ -62,227 +1732,492 @@ class BiliSearchPlugin(PluginBase):
             logger.exception(f"BiliSearchPlugin 插件初始化失败: {e}")
             return {}
 
-    async def _search_video(self, keyword: str) -> Optional[dict]:
-        """根据关键词搜索视频."""
+    async def on_enable(self, bot=None):
+        """插件启用时按配置启动指标接口和定期日志."""
+        await super().on_enable(bot)
+        await self.metrics.start(self.metrics_port, self.metrics_log_interval)
+
+    async def on_disable(self):
+        """插件禁用时发出已排队的消息，关闭共享的 HTTP 会话，并把未写盘的数据保存到磁盘."""
+        await super().on_disable()
+        await self.metrics.stop()
+        if self._prefetcher is not None:
+            self._prefetcher.cancel_all()
+        if self._outbox is not None:
+            await self._outbox.close(self.outbox_close_timeout)
+        if self._sheets is not None:
+            self._sheets.close()
+        await self._close_session()
+        await self._backend.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 HTTP 会话，首次调用时创建连接池."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.http_limit,
+                limit_per_host=self.http_limit_per_host,
+                keepalive_timeout=self.http_keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.http_dns_cache_ttl,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=self.http_total_timeout or None,
+                sock_connect=self.http_connect_timeout,
+                sock_read=self.http_read_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            logger.debug("BiliSearchPlugin 已创建共享 HTTP 连接池")
+        return self._session
+
+    async def _close_session(self):
+        """关闭共享的 HTTP 会话并释放连接池."""
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+            logger.debug("BiliSearchPlugin 已关闭共享 HTTP 连接池")
+
+    @staticmethod
+    def _normalize_keyword(keyword: str) -> str:
+        """规范化搜索关键词：合并空白并忽略大小写，作为缓存的 key."""
+        return " ".join(keyword.split()).casefold()
+
+    def get_cache_stats(self) -> dict:
+        """返回搜索缓存的统计信息."""
+        return {**self.search_cache_stats, "size": len(self._search_cache)}
+
+    def get_metrics(self) -> dict:
+        """返回插件指标快照（各阶段耗时、缓存命中、会话数量、上游状态等）."""
+        return self.metrics.snapshot()
+
+    async def _send_text(self, bot: WechatAPIClient, chat_id: str, text: str, supersede: Optional[str] = None):
+        """发送文本消息；开启发送队列时放入队列后立即返回，supersede 相同的未发送消息会被替换."""
+        if self._outbox is not None:
+            self._outbox.put(chat_id, lambda: self._deliver_text(bot, chat_id, text), supersede)
+        else:
+            await self._deliver_text(bot, chat_id, text)
+
+    async def _send_app(self, bot: WechatAPIClient, chat_id: str, xml: str, type_: int):
+        """发送卡片消息；开启发送队列时放入队列后立即返回."""
+        if self._outbox is not None:
+            self._outbox.put(chat_id, lambda: self._deliver_app(bot, chat_id, xml, type_))
+        else:
+            await self._deliver_app(bot, chat_id, xml, type_)
+
+    async def _send_image(self, bot: WechatAPIClient, chat_id: str, image: bytes, supersede: Optional[str] = None):
+        """发送图片消息；开启发送队列时放入队列后立即返回."""
+        if self._outbox is not None:
+            self._outbox.put(chat_id, lambda: self._deliver_image(bot, chat_id, image), supersede)
+        else:
+            await self._deliver_image(bot, chat_id, image)
+
+    async def _deliver_text(self, bot: WechatAPIClient, chat_id: str, text: str):
+        with self.metrics.timer("send.text"):
+            await bot.send_text_message(chat_id, text)
+
+    async def _deliver_app(self, bot: WechatAPIClient, chat_id: str, xml: str, type_: int):
+        with self.metrics.timer("send.app"):
+            await bot.send_app_message(chat_id, xml, type_)
+
+    async def _deliver_image(self, bot: WechatAPIClient, chat_id: str, image: bytes):
+        with self.metrics.timer("send.image"):
+            await bot.send_image_message(chat_id, image)
+
+    def get_outbox_stats(self) -> dict:
+        """返回发送队列的统计信息（排队深度、替换/丢弃的消息数、发送耗时等）."""
+        return self._outbox.snapshot() if self._outbox is not None else {}
+
+    def get_upstream_stats(self) -> dict:
+        """返回上游请求的统计信息（排队深度、等待时间、重试、对冲、熔断等）."""
+        return {
+            **self._limiter.snapshot(),
+            **self.resilience_stats,
+            "circuit_state": self._breaker.state,
+            "circuit_opened": self._breaker.stats["opened"],
+            "circuit_rejected": self._breaker.stats["rejected"],
+        }
+
+    async def _get(self, url: str, chat_id: str, read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Tuple[int, Any]:
+        """发送 GET 请求，状态码为 200 时用 read 读取响应，返回 (状态码, 数据).
+
+        熔断期间立即抛出 _UpstreamUnavailable；网络错误和 5xx 按指数退避加随机抖动重试。
+        所有尝试（含排队和退避）共用 retry_deadline 秒的期限，上游卡住时不会因重试而成倍延长等待。
+        """
+        if not self._breaker.allow():
+            raise _UpstreamUnavailable()
+        error: Optional[BaseException] = None
+        status, data = 0, None
+        try:
+            async with asyncio.timeout(self.retry_deadline or None):
+                for attempt in range(self.retry_attempts + 1):
+                    if attempt:
+                        self.resilience_stats["retries"] += 1
+                        await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+                    try:
+                        status, data = await self._get_hedged(url, chat_id, read)
+                    except _UpstreamBusy:
+                        raise
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        error = e
+                        continue
+                    if status < 500:
+                        self._breaker.record_success()
+                        return status, data
+                    error = None
+        except TimeoutError as e:
+            self.resilience_stats["deadline_exceeded"] += 1
+            error = e
+        self._breaker.record_failure()
+        if error is not None:
+            raise error
+        return status, data
+
+    async def _get_hedged(self, url: str, chat_id: str, read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Tuple[int, Any]:
+        """请求耗时超过近期的延迟百分位时，再发一个对冲请求，采用先成功返回的结果."""
+        delay = self._latency.percentile(self.hedge_percentile) if self.hedge_enable else None
+        if delay is None:
+            return await self._get_once(url, chat_id, read)
+
+        tasks = {asyncio.ensure_future(self._get_once(url, chat_id, read))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.resilience_stats["hedges"] += 1
+                tasks.add(asyncio.ensure_future(self._get_once(url, chat_id, read)))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _get_once(self, url: str, chat_id: str, read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Tuple[int, Any]:
+        """经由上游调度器发送一次 GET 请求."""
+        async with self._limiter.slot(chat_id):
+            start = time.monotonic()
+            async with self._get_session().get(url) as response:
+                if response.status != 200:
+                    return response.status, None
+                data = await read(response)
+            self._latency.record(time.monotonic() - start)
+            return response.status, data
+
+    async def _search_video(self, keyword: str, chat_id: str = "") -> Optional[dict]:
+        """根据关键词搜索视频，优先使用缓存，并合并相同关键词的并发请求."""
         if not self.api_url:
             logger.error("API URL 未配置")
             return None
 
+        key = self._normalize_keyword(keyword)
+        cached = self._search_cache.get(key)
+        if cached is not None:
+            self.search_cache_stats["hits"] += 1
+            return cached
+
+        if self._catalog is not None:
+            videos = self._catalog.search(key, self.catalog_max_results)
+            self.metrics.incr("catalog.hit" if videos else "catalog.miss")
+            if videos:
+                return {"code": 200, "data": videos}
+
+        data, shared = await self._search_flight.do(key, lambda: self._load_search(key, " ".join(keyword.split()), chat_id))
+        self.search_cache_stats["coalesced" if shared else "misses"] += 1
+        return data
+
+    async def _load_search(self, key: str, keyword: str, chat_id: str) -> Optional[dict]:
+        """依次从状态后端和上游接口获取搜索结果."""
+        if self._backend.shared:
+            data = await self._backend.get("search", key)
+            if data is not None:
+                self._search_cache.set(key, data)
+                if self._catalog is not None:
+                    self._catalog.add(key, data["data"])
+                return data
+        try:
+            data = await self._fetch_search(key, keyword, chat_id)
+        except _UpstreamUnavailable:
+            data = None
+            if self._search_cache.get_stale(key) is None:
+                raise
+        if data is None:
+            # 上游失败或熔断时，用过期的缓存兜底
+            data = self._search_cache.get_stale(key)
+            if data is not None:
+                logger.warning(f"上游接口不可用，使用过期的搜索结果: {keyword}")
+        return data
+
+    async def _fetch_search(self, key: str, keyword: str, chat_id: str) -> Optional[dict]:
+        """请求上游搜索接口，成功的结果写入缓存."""
         try:
             url = f"{self.api_url}?msg={keyword}"
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        # 确保返回结果包含list_url
-                        if data and data["code"] == 200 and "data" in data:
-                            for item in data["data"]:
-                                if self.LIST_URL_KEY not in item:
-                                    logger.warning(f"API 返回结果缺少 {self.LIST_URL_KEY} 字段: {item}")
-                        return data
-                    else:
-                        logger.error(f"搜索视频失败，状态码: {response.status}")
-                        return None
+            with self.metrics.timer("upstream.search"):
+                status, data = await self._get(url, chat_id, lambda response: response.json())
+            self.metrics.incr(f"upstream.search.status_{status}")
+            if status == 200:
+                # 确保返回结果包含list_url
+                if data and data["code"] == 200 and "data" in data:
+                    for item in data["data"]:
+                        if self.LIST_URL_KEY not in item:
+                            logger.warning(f"API 返回结果缺少 {self.LIST_URL_KEY} 字段: {item}")
+                    if data["data"]:
+                        self._search_cache.set(key, data)
+                        if self._catalog is not None:
+                            self._catalog.add(key, data["data"])
+                        if self._backend.shared:
+                            self._backend.put("search", key, data, self.search_cache_ttl)
+                return data
+            else:
+                logger.error(f"搜索视频失败，状态码: {status}")
+                return None
+        except _UpstreamBusy:
+            raise
         except Exception as e:
+            self.metrics.incr("upstream.search.error")
             logger.exception(f"搜索视频过程中发生异常: {e}")
             return None
 
-    async def _get_video_urls(self, list_url: str) -> Optional[List[str]]:
-        """根据 list_url 获取视频链接列表"""
+    async def _fetch_cover(self, url: str) -> Optional[bytes]:
+        """下载封面图片，失败时返回 None；封面来自图床，不经过上游接口的调度和熔断."""
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-                async with session.get(list_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data and "data" in data:
-                            video_urls = [item.get("mp4") for item in data["data"] if item.get("mp4")]
-                            return video_urls
-                        else:
-                            logger.warning(f"获取视频链接失败，API 返回错误: {data}")
-                            return None
-                    else:
-                        logger.error(f"获取视频链接失败，状态码: {response.status}")
+            with self.metrics.timer("cover.fetch"):
+                async with self._get_session().get(url) as response:
+                    if response.status != 200:
                         return None
+                    return await response.read()
         except Exception as e:
-            logger.exception(f"获取视频链接过程中发生异常: {e}")
+            logger.debug(f"下载封面失败: {url}: {e}")
             return None
 
-    async def _get_episodes(self, list_url: str) -> Optional[List[str]]:
-        """根据 list_url 获取视频的剧集列表"""
+    async def _render_search_sheet(self, videos: List[dict], first_number: int) -> Optional[bytes]:
+        """生成搜索结果页的封面拼图，超出 image_render_budget 或失败时返回 None."""
         try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-                async with session.get(list_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data and "data" in data:
-                            episodes = data["data"]
-                            episode_titles = [f"第{i + 1}集 {ep.get('title', '')}".replace(f" {i + 1}", "") for i, ep in enumerate(episodes)]  # 添加剧集名字，并移除重复数字
-                            return episode_titles
-                        else:
-                            logger.warning(f"获取剧集列表失败，API 返回错误: {data}")
-                            return None
-                    else:
-                        logger.error(f"获取剧集列表失败，状态码: {response.status}")
-                        return None
+            with self.metrics.timer("render.sheet"):
+                return await asyncio.wait_for(self._sheets.render(videos, first_number), self.image_render_budget)
+        except asyncio.TimeoutError:
+            self.metrics.incr("render.sheet.timeout")
+            logger.info(f"生成封面拼图超过 {self.image_render_budget} 秒，只发送文字")
+        except Exception:
+            self.metrics.incr("render.sheet.error")  # 原因已在 _ContactSheets 中记录
+        return None
+
+    async def _resolve_list(self, list_url: str, chat_id: str = "") -> Optional["_EpisodeList"]:
+        """解析 list_url，返回剧集标题和播放链接；结果跨会话缓存，并发请求只访问一次上游."""
+        cached = self._list_cache.get(list_url)
+        if cached is not None:
+            self.metrics.incr("list_cache.hit")
+            return cached
+        self.metrics.incr("list_cache.miss")
+        record, _ = await self._list_flight.do(list_url, lambda: self._load_list(list_url, chat_id))
+        return record
+
+    async def _load_list(self, list_url: str, chat_id: str) -> Optional["_EpisodeList"]:
+        """依次从状态后端和上游接口获取剧集列表."""
+        if self._backend.shared:
+            data = await self._backend.get("list", list_url)
+            if data is not None:
+                record = _EpisodeList.from_dict(data)
+                self._list_cache.set(list_url, record)
+                return record
+        try:
+            record = await self._fetch_list(list_url, chat_id)
+        except _UpstreamUnavailable:
+            record = None
+            if self._list_cache.get_stale(list_url) is None:
+                raise
+        if record is None:
+            # 上游失败或熔断时，用过期的缓存兜底
+            record = self._list_cache.get_stale(list_url)
+            if record is not None:
+                logger.warning(f"上游接口不可用，使用过期的剧集列表: {list_url}")
+        return record
+
+    async def _fetch_list(self, list_url: str, chat_id: str) -> Optional["_EpisodeList"]:
+        """请求 list_url，流式解析出剧集名和播放链接并写入缓存."""
+        try:
+            with self.metrics.timer("upstream.list"):
+                status, record = await self._get(list_url, chat_id, _read_episode_list)
+            self.metrics.incr(f"upstream.list.status_{status}")
+            if status == 200:
+                if record is not None:
+                    self._list_cache.set(list_url, record)
+                    if self._backend.shared:
+                        self._backend.put("list", list_url, record.to_dict(), self.list_cache_ttl)
+                    return record
+                else:
+                    logger.warning(f"获取剧集列表失败，API 返回数据中没有剧集: {list_url}")
+                    return None
+            else:
+                logger.error(f"获取剧集列表失败，状态码: {status}")
+                return None
+        except _UpstreamBusy:
+            raise
         except Exception as e:
+            self.metrics.incr("upstream.list.error")
             logger.exception(f"获取剧集列表过程中发生异常: {e}")
             return None
 
+    async def _chat_session(self, chat_id: str) -> Optional[_ChatSession]:
+        """获取聊天会话，内存中没有时尝试从状态后端的快照恢复.
+
+        多进程模式下，即使内存中有会话，也会检查其他进程是否保存了更新的快照。
+        """
+        session = self.sessions.get(chat_id)
+        if not self._backend.shared or (session is not None and not self.state_multi_process):
+            return session
+        snapshot = await self._backend.get("session", chat_id)
+        if snapshot is None or (session is not None and snapshot.get("updated_at", 0) <= session.updated_at):
+            return session
+        return await self._restore_session(chat_id, snapshot) or session
+
+    async def _restore_session(self, chat_id: str, snapshot: dict) -> Optional[_ChatSession]:
+        """根据快照重建会话，搜索结果必须与用户当时看到的列表一致.
+
+        恢复时不重新搜索：优先使用本进程缓存中相同的结果列表，否则读取随会话保存的结果，
+        都没有时放弃恢复，避免 “视频 N” 对应到用户没有见过的视频。
+        """
+        list_urls = snapshot.get("list_urls")
+        if not list_urls:
+            return None
+        cached = self._search_cache.get_stale(self._normalize_keyword(snapshot["keyword"]))
+        if cached is not None and self._list_urls(cached["data"]) == list_urls:
+            video_list = cached["data"]  # 引用共享缓存中的视频列表，不复制
+        else:
+            video_list = await self._backend.get("results", chat_id)
+            if not video_list or self._list_urls(video_list) != list_urls:
+                logger.debug(f"{chat_id} 的会话快照与保存的搜索结果不一致，不恢复")
+                return None
+        session = _ChatSession()
+        session.keyword = snapshot["keyword"]
+        session.video_list = video_list
+        session.current_page = snapshot.get("current_page", 1)
+        session.updated_at = snapshot.get("updated_at", 0)
+        video_index = snapshot.get("video_index")
+        if video_index and video_index <= len(session.video_list):
+            list_url = session.video_list[video_index - 1].get(self.LIST_URL_KEY)
+            # 搜索结果有变化时不恢复剧集状态，避免对应到错误的视频
+            if list_url and list_url == snapshot.get("list_url"):
+                record = await self._resolve_list(list_url, chat_id)
+                if record:
+                    session.video_index = video_index
+                    session.episodes = record
+                    session.start_index = min(snapshot.get("start_index", 0), len(record) - 1)
+        self.sessions.save(chat_id, session)
+        logger.debug(f"已从状态后端的快照恢复 {chat_id} 的会话")
+        return session
+
+    def _list_urls(self, video_list: List[dict]) -> List[Optional[str]]:
+        return [video.get(self.LIST_URL_KEY) for video in video_list]
+
+    def _save_session(self, chat_id: str, session: _ChatSession, new_results: bool = False):
+        """保存会话，状态后端可共享时同时写入会话快照.
+
+        new_results 为 True 表示会话换了一组搜索结果，此时连同结果列表一起写入，保存时长与会话相同，
+        不受搜索缓存有效期的限制。
+        """
+        session.updated_at = time.time()
+        self.sessions.save(chat_id, session)
+        if self._backend.shared:
+            if new_results:
+                self._backend.put("results", chat_id, session.video_list, self.session_idle_ttl)
+            list_url = session.video_list[session.video_index - 1].get(self.LIST_URL_KEY) if session.video_index else None
+            snapshot = {
+                "keyword": session.keyword,
+                "list_urls": self._list_urls(session.video_list),
+                "current_page": session.current_page,
+                "video_index": session.video_index,
+                "list_url": list_url,
+                "start_index": session.start_index,
+                "updated_at": session.updated_at,
+            }
+            # 多进程模式下尽快写出，用户的下一条消息可能由其他进程处理
+            self._backend.put("session", chat_id, snapshot, self.session_idle_ttl, urgent=self.state_multi_process)
+
     def get_number_emoji(self, num):
         """将数字转换为对应的 Emoji 序号"""
-        num_str = str(num)
-        emoji_dict = {
-            '0': '0️⃣', '1': '1️⃣', '2': '2️⃣', '3': '3️⃣',
-            '4': '4️⃣', '5': '5️⃣', '6': '6️⃣', '7': '7️⃣',
-            '8': '8️⃣', '9': '9️⃣'
-        }
-        return ''.join(emoji_dict.get(digit, digit) for digit in num_str)
+        return _PageRenderer.number_emoji(num)
 
     async def _handle_play_command(self, bot: WechatAPIClient, chat_id: str, content: str) -> bool:
         """处理播放命令."""
         try:
             index_str = content.split()[1].strip()
             index = int(index_str)
-            if chat_id in self.search_results:
-                video_list = self.search_results[chat_id]["video_list"]
+            session = await self._chat_session(chat_id)
+            if session is not None:
+                video_list = session.video_list
                 if 1 <= index <= len(video_list):
                     video = video_list[index - 1]
                     list_url = video.get(self.LIST_URL_KEY)
 
                     if list_url:
                         # 检查是否已经获取过该视频的剧集信息
-                        if chat_id in self.episode_results and index in self.episode_results[chat_id]:
-                            episode_data = self.episode_results[chat_id][index]
-                            episode_list = episode_data["episodes"]
-                            start_index = episode_data["start_index"]
-                            total_episodes = len(episode_list)
-                            total_pages = (total_episodes + self.EPISODES_PER_BATCH - 1) // self.EPISODES_PER_BATCH
-                            current_page = (start_index // self.EPISODES_PER_BATCH) + 1
-                            end_index = min(start_index + self.EPISODES_PER_BATCH, total_episodes)
-                            display_list = episode_list[start_index:end_index]
-
-                            # 发送剧集列表供用户选择
-                            response_text = f"🎬———{video['title']} ———🎬\n"
-                            for i, episode in enumerate(display_list):
-                                episode_number = start_index + i + 1
-                                number_emoji = self.get_number_emoji(episode_number)
-                                response_text += f"{number_emoji}. {episode}\n"
-
-                            # 添加当前页码
-                            page_emoji = self.get_number_emoji(current_page)
-                            total_page_emoji = self.get_number_emoji(total_pages)
-                            response_text += f"       🎞️{page_emoji}/{total_page_emoji}🎞️\n"
-
-                            response_text += "_________________________\n"
-                            response_text += f"🎵输入 “序号 + 数字” 选择剧集🎵\n"
-                            navigation_tips = "🎵输入 “下一页” “上一页” “最后一页”🎵"  # 简化
-                            response_text += navigation_tips
-                            await bot.send_text_message(chat_id, response_text)
-                            self.current_video_index[chat_id] = index
-                            return False  # 阻止后续操作
-                        else:
+                        if session.video_index != index or session.episodes is None:
                             # 获取剧集信息
-                            episode_list = await self._get_episodes(list_url)
-                            if episode_list:
-                                if chat_id not in self.episode_results:
-                                    self.episode_results[chat_id] = {}
-
-                                self.episode_results[chat_id][index] = {
-                                    "episodes": episode_list,
-                                    "start_index": 0,
-                                }
-                                start_index = 0
-                                total_episodes = len(episode_list)
-                                total_pages = (total_episodes + self.EPISODES_PER_BATCH - 1) // self.EPISODES_PER_BATCH
-                                current_page = 1
-                                end_index = min(start_index + self.EPISODES_PER_BATCH, total_episodes)
-                                display_list = episode_list[start_index:end_index]
-
-                                # 发送剧集列表供用户选择
-                                response_text = f"🎬———{video['title']} ———🎬\n"
-                                for i, episode in enumerate(display_list):
-                                    episode_number = start_index + i + 1
-                                    number_emoji = self.get_number_emoji(episode_number)
-                                    response_text += f"{number_emoji}. {episode}\n"
-
-                                # 添加当前页码
-                                page_emoji = self.get_number_emoji(current_page)
-                                total_page_emoji = self.get_number_emoji(total_pages)
-                                response_text += f"       🎞️{page_emoji}/{total_page_emoji}🎞️\n"
-
-                                response_text += "_________________________\n"
-                                response_text += f"🎵输入 “序号 + 数字” 选择剧集🎵\n"
-                                navigation_tips = "🎵输入 “下一页” “上一页” “最后一页”🎵"  # 简化
-                                response_text += navigation_tips
-                                await bot.send_text_message(chat_id, response_text)
-                                self.current_video_index[chat_id] = index
-                                return False  # 阻止后续操作
-                            else:
-                                await bot.send_text_message(chat_id, "无法获取该视频的剧集信息。")
+                            record = await self._resolve_list(list_url, chat_id)
+                            if not record:
+                                await self._send_text(bot, chat_id, "无法获取该视频的剧集信息。")
                                 return False
+                            session.video_index = index
+                            session.episodes = record  # 引用共享缓存中的剧集列表，不复制
+                            session.start_index = 0
+                            self._save_session(chat_id, session)
+
+                        # 发送剧集列表供用户选择
+                        response_text = self._renderer.episode_page(video["title"], session.episodes, session.start_index)
+                        await self._send_text(bot, chat_id, response_text, supersede="episode_page")
+                        return False  # 阻止后续操作
                     else:
-                        await bot.send_text_message(chat_id, "视频信息中缺少 list_url。")
+                        await self._send_text(bot, chat_id, "视频信息中缺少 list_url。")
                 else:
-                    await bot.send_text_message(chat_id, "无效的视频编号。")
+                    await self._send_text(bot, chat_id, "无效的视频编号。")
             else:
-                await bot.send_text_message(chat_id, "请先搜索视频。")
+                await self._send_text(bot, chat_id, "请先搜索视频。")
             return False
         except ValueError:
             # 尝试直接解析集数
             try:
                 episode_number = int(index_str)
-                if chat_id in self.current_video_index:
-                    video_index = self.current_video_index[chat_id]
-                    episode_data = self.episode_results[chat_id][video_index]
-                    episode_list = episode_data["episodes"]
-                    if 1 <= episode_number <= len(episode_list):
+                session = await self._chat_session(chat_id)
+                if session is not None and session.episodes is not None:
+                    if 1 <= episode_number <= len(session.episodes):
                         content = f"序号 {episode_number}"
                          # 递归调用，传递正确的序号选择消息
                         return await self._handle_episode_selection(bot, chat_id, content) 
                     else:
-                        await bot.send_text_message(chat_id, "无效的剧集编号。")
+                        await self._send_text(bot, chat_id, "无效的剧集编号。")
                         return False
                 else:
-                    await bot.send_text_message(chat_id, "请先选择视频并查看剧集列表。")
+                    await self._send_text(bot, chat_id, "请先选择视频并查看剧集列表。")
                     return False
 
             except ValueError:
-                await bot.send_text_message(chat_id, "请输入有效的数字编号。")
+                await self._send_text(bot, chat_id, "请输入有效的数字编号。")
                 return False
+        except _UpstreamBusy:
+            raise
         except Exception as e:
             logger.exception(f"处理视频卡片消息过程中发生异常: {e}")
-            await bot.send_text_message(chat_id, f"处理视频卡片消息过程中发生异常: {e}")
+            await self._send_text(bot, chat_id, f"处理视频卡片消息过程中发生异常: {e}")
             return False
 
     async def _handle_episode_selection(self, bot: WechatAPIClient, chat_id: str, content: str) -> bool:
         """处理剧集选择命令，并发送卡片消息."""
         try:
-            if chat_id in self.current_video_index:
-                video_index = self.current_video_index[chat_id]
+            session = await self._chat_session(chat_id)
+            if session is not None and session.video_index is not None:
+                video_index = session.video_index
                 episode_index = int(content.split()[1].strip())
-                if (
-                    chat_id in self.search_results
-                    and chat_id in self.episode_results
-                    and video_index in self.episode_results[chat_id]
-                ):
-                    video_list = self.search_results[chat_id]["video_list"]
-                    video = video_list[video_index - 1]
-                    list_url = video.get(self.LIST_URL_KEY)
-
-                    episode_data = self.episode_results[chat_id][video_index]
-                    episode_list = episode_data["episodes"]
-                    start_index = episode_data["start_index"]
-                    total_episodes = len(episode_list)
-                    total_pages = (total_episodes + self.EPISODES_PER_BATCH - 1) // self.EPISODES_PER_BATCH
-                    current_page = (start_index // self.EPISODES_PER_BATCH) + 1
-
-                    if 1 <= episode_index <= len(episode_list):
-                        video_urls = await self._get_video_urls(list_url)
-                        if video_urls and len(video_urls) > episode_index - 1:
-                            video_url = video_urls[episode_index - 1]
-
+                if session.episodes is not None:
+                    video = session.video_list[video_index - 1]
+                    if 1 <= episode_index <= len(session.episodes):
+                        # 播放链接在获取剧集列表时已一并解析，无需再次请求上游
+                        video_url = session.episodes.urls[episode_index - 1]
+                        if video_url:
                             # 获取剧集信息
-                            episode_title = episode_list[episode_index - 1]
+                            episode_title = session.episodes.title(episode_index - 1)
 
                             # 从 video 变量中获取信息
                             title = f"🎉{video['title']} - {episode_title}🎉"  # 视频标题 + 剧集标题
@@ -297,105 +2232,103 @@ class BiliSearchPlugin(PluginBase):
                             # 构造XML消息
                             xml = f"""<appmsg appid="wx79f2c4418704b4f8" sdkver="0"><title>{title}</title><des>{description}</des><action>view</action><type>5</type><showtype>0</showtype><content/><url>{url}</url><dataurl/><lowurl/><lowdataurl/><recorditem/><thumburl>{thumbnail}</thumburl><messageaction/><laninfo/><extinfo/><sourceusername/><sourcedisplayname/><commenturl/><appattach><totallen>0</totallen><attachid/><emoticonmd5/><fileext/><aeskey/></appattach><webviewshared><publisherId/><publisherReqId>0</publisherReqId></webviewshared><weappinfo><pagepath/><username/><appid/><appservicetype>0</appservicetype></weappinfo><websearch/><songalbumurl/></appmsg><fromusername>{bot.wxid}</fromusername><scene>0</scene><appinfo><version>1</version><appname/></appinfo><commenturl/>"""  #注意：type=5 是网页链接
 
-                            await bot.send_app_message(chat_id, xml, 5)  # type=5 是网页链接
+                            await self._send_app(bot, chat_id, xml, 5)  # type=5 是网页链接
                             logger.info(f"发送卡片消息到 {chat_id}: {title}")
 
                             # 发送视频链接
-                            await bot.send_text_message(chat_id, f"📺 视频链接：{video_url}")
+                            await self._send_text(bot, chat_id, f"📺 视频链接：{video_url}")
                             return False
                         else:
-                            await bot.send_text_message(chat_id, "无法获取该集视频链接或该视频没有播放资源。")
+                            await self._send_text(bot, chat_id, "无法获取该集视频链接或该视频没有播放资源。")
                             return False
                     else:
-                        await bot.send_text_message(chat_id, "无效的剧集编号。")
+                        await self._send_text(bot, chat_id, "无效的剧集编号。")
                         return False
                 else:
-                    await bot.send_text_message(chat_id, "请先选择视频并查看剧集列表。")
+                    await self._send_text(bot, chat_id, "请先选择视频并查看剧集列表。")
                     return False
             else:
-                await bot.send_text_message(chat_id, "请先选择视频。")
+                await self._send_text(bot, chat_id, "请先选择视频。")
                 return False
         except ValueError:
-            await bot.send_text_message(chat_id, "请输入有效的剧集数字编号。")
+            await self._send_text(bot, chat_id, "请输入有效的剧集数字编号。")
             return False
+        except _UpstreamBusy:
+            raise
         except Exception as e:
             logger.exception(f"处理视频卡片消息过程中发生异常: {e}")
-            await bot.send_text_message(chat_id, f"处理视频卡片消息过程中发生异常: {e}")
+            await self._send_text(bot, chat_id, f"处理视频卡片消息过程中发生异常: {e}")
             return False
 
     async def _handle_search_command(self, bot: WechatAPIClient, chat_id: str, content: str) -> bool:
         """处理搜索命令."""
         parts = content.split()
         if len(parts) < 1:  # 修改判断条件
-            await bot.send_text_message(chat_id, "请输入要搜索的关键词。")
+            await self._send_text(bot, chat_id, "请输入要搜索的关键词。")
             return False
 
         keyword = " ".join(parts[1:])  # 获取关键词
         # 如果没有关键词，提示
         if not keyword:
-            await bot.send_text_message(chat_id, "请输入要搜索的关键词。")
+            await self._send_text(bot, chat_id, "请输入要搜索的关键词。")
             return False
 
         try:
-            search_result = await self._search_video(keyword)
+            search_result = await self._search_video(keyword, chat_id)
 
             if search_result and search_result["code"] == 200 and search_result["data"]:
                 video_list = search_result["data"]
-                total_videos = len(search_result["data"])
-                total_pages = (total_videos + self.RESULTS_PER_PAGE - 1) // self.RESULTS_PER_PAGE
                 current_page = 1  # 默认显示第一页
-                start_index = (current_page - 1) * self.RESULTS_PER_PAGE
-                end_index = min(current_page * self.RESULTS_PER_PAGE, total_videos)
-                display_list = video_list[start_index:end_index]
-
-                response_text = f"🎬———B站视频———🎬\n"
-                for i, video in enumerate(display_list):
-                    number_emoji = self.get_number_emoji(start_index + i + 1)
-                    video_type_emoji = "🎞️" if "剧场版" in video["title"] else "🎞️"
-                    response_text += f"{number_emoji}. {video['title']}{video_type_emoji}\n"
-                response_text += "_________________________\n"
-                response_text += f"🎵输入 “{self.play_command.strip()}+序号” 选择视频🎵\n"
-                response_text += f"当前：{current_page}/{total_pages}页, 输入 “下一页” “上一页” “最后一页”"  # 简化
-
-                self.search_results[chat_id] = {
-                    "keyword": keyword,
-                    "video_list": video_list,  # 保存所有视频
-                    "total_pages": total_pages,
-                    "current_page": current_page,
-                }  # 保存搜索结果
-                await bot.send_text_message(chat_id, response_text)
-                logger.info(f"成功发送视频搜索结果 (文字) 到 {chat_id}, 第{current_page}页")
+                response_text = self._renderer.search_page(video_list, current_page)
+
+                # 保存搜索结果，新的搜索会清空之前选择的视频
+                session = self.sessions.get_or_create(chat_id)
+                session.keyword = keyword
+                session.video_list = video_list  # 引用共享缓存中的视频列表，不复制
+                session.current_page = current_page
+                session.video_index = None
+                session.episodes = None
+                session.start_index = 0
+                self._save_session(chat_id, session, new_results=True)
+                if self._sheets is not None:
+                    start_index = (current_page - 1) * self.RESULTS_PER_PAGE
+                    image = await self._render_search_sheet(video_list[start_index:start_index + self.RESULTS_PER_PAGE], start_index + 1)
+                    if image is not None:
+                        await self._send_image(bot, chat_id, image, supersede="search_image")
+                await self._send_text(bot, chat_id, response_text, supersede="search_page")
+                logger.info(f"成功发送视频搜索结果到 {chat_id}, 第{current_page}页")
+
+                # 大多数用户接下来会选择排在前面的视频，提前获取它们的剧集列表（已包含每集播放链接）
+                if self._prefetcher is not None:
+                    self._prefetcher.schedule(chat_id, [video.get(self.LIST_URL_KEY) for video in video_list[:self.prefetch_top_k]])
                 return False
 
             else:
-                await bot.send_text_message(chat_id, "未找到相关视频。")
+                await self._send_text(bot, chat_id, "未找到相关视频。")
                 logger.warning(f"未找到关键词为 {keyword} 的视频")
                 return False
 
+        except _UpstreamBusy:
+            raise
         except Exception as e:
             logger.exception(f"处理视频搜索过程中发生异常: {e}")
-            await bot.send_text_message(chat_id, f"处理视频搜索过程中发生异常: {e}")
+            await self._send_text(bot, chat_id, f"处理视频搜索过程中发生异常: {e}")
             return False
 
     async def _handle_episode_navigation(self, bot: WechatAPIClient, chat_id: str, content: str) -> bool:
         """处理剧集翻页命令."""
-        if chat_id not in self.current_video_index:
-            await bot.send_text_message(chat_id, "请先选择视频。")
+        session = await self._chat_session(chat_id)
+        if session is None or session.video_index is None:
+            await self._send_text(bot, chat_id, "请先选择视频。")
             return False
 
-        video_index = self.current_video_index[chat_id]
-        if (
-            chat_id not in self.episode_results
-            or video_index not in self.episode_results[chat_id]
-        ):
-            await bot.send_text_message(chat_id, "请先选择视频并查看剧集列表。")
+        video_index = session.video_index
+        if session.episodes is None:
+            await self._send_text(bot, chat_id, "请先选择视频并查看剧集列表。")
             return False
 
-        episode_data = self.episode_results[chat_id][video_index]
-        episode_list = episode_data["episodes"]
-        start_index = episode_data["start_index"]
-        total_episodes = len(episode_list)
-        total_pages = (total_episodes + self.EPISODES_PER_BATCH - 1) // self.EPISODES_PER_BATCH
+        start_index = session.start_index
+        total_episodes = len(session.episodes)
 
         new_start_index = start_index
 
@@ -411,77 +2344,64 @@ class BiliSearchPlugin(PluginBase):
         elif new_start_index >= total_episodes:
             new_start_index = max(0, total_episodes - self.EPISODES_PER_BATCH)  # 最后一页
 
-        self.episode_results[chat_id][video_index]["start_index"] = new_start_index
-
-        end_index = min(new_start_index + self.EPISODES_PER_BATCH, total_episodes)
-        display_list = episode_list[new_start_index:end_index]
-        video = self.search_results[chat_id]["video_list"][video_index - 1]
+        session.start_index = new_start_index
+        self._save_session(chat_id, session)
+        if self._coordinator.superseded(chat_id, "navigate"):
+            self.metrics.incr("navigate.debounced")
+            return False  # 后面还有翻页命令排队，只渲染最后一次
 
         # 发送剧集列表供用户选择
-        response_text = f"🎬———{video['title']} ———🎬\n"
-        for i, episode in enumerate(display_list):
-            episode_number = new_start_index + i + 1
-            number_emoji = self.get_number_emoji(episode_number)
-            response_text += f"{number_emoji}. {episode}\n"
-
-        # 添加当前页码
-        current_page = (new_start_index // self.EPISODES_PER_BATCH) + 1
-        page_emoji = self.get_number_emoji(current_page)
-        total_page_emoji = self.get_number_emoji(total_pages)
-        response_text += f"       🎞️{page_emoji}/{total_page_emoji}🎞️\n"
-
-        response_text += "_________________________\n"
-        response_text += f"🎵输入 “序号 + 数字” 选择剧集🎵\n"
-        navigation_tips = "🎵输入 “下一页” “上一页” “最后一页”🎵"  # 简化
-        response_text += navigation_tips
-
-        await bot.send_text_message(chat_id, response_text)
+        video = session.video_list[video_index - 1]
+        response_text = self._renderer.episode_page(video["title"], session.episodes, new_start_index)
+        await self._send_text(bot, chat_id, response_text, supersede="episode_page")
         return False
 
+    def _build_command_pattern(self) -> "re.Pattern":
+        """根据配置的命令构建一次性编译的匹配正则.
+
+        各分支按原有的判断优先级排列：播放、剧集选择、翻页、搜索（消息中包含命令即可）、直接播放第几集。
+        不匹配的消息在一次匹配中即被排除。
+        """
+        branches = [
+            f"(?P<play>{re.escape(self.play_command)})",
+            "(?P<select>序号 )",
+            r"(?P<navigate>(?:下一页|上一页|最后一页)\Z)",
+        ]
+        search_commands = "|".join(re.escape(command) for command in self.commands if command)
+        if search_commands:
+            branches.append(f"(?P<search>.*?(?:{search_commands}))")
+        branches.append(r"(?P<episode>第.*集\Z)")
+        return re.compile("|".join(branches), re.DOTALL)
+
+    async def _handle_episode_shortcut(self, bot: WechatAPIClient, chat_id: str, content: str) -> bool:
+        """处理直接播放第几集的命令."""
+        try:
+            episode_number = int(content[1:-1])
+        except ValueError:
+            await self._send_text(bot, chat_id, "请输入有效的剧集数字编号。")
+            return False
+        logger.info(f"尝试直接播放第{episode_number}集")
+        # 转换为序号选择消息
+        return await self._handle_episode_selection(bot, chat_id, f"序号 {episode_number}")
+
     @on_text_message
     async def handle_text_message(self, bot: WechatAPIClient, message: dict) -> bool:
         """处理文本消息，判断是否需要触发发送视频链接."""
         if not self.enable:
-            logger.info("插件未启用，不处理消息")
             return True  # 插件未启用，不阻塞
 
         content = message["Content"].strip()
-        chat_id = message["FromWxid"]
+        match = self._command_pattern.match(content)
+        if match is None:
+            return True  # 没有匹配到任何命令，不阻塞
 
-        logger.info(f"收到消息：content={content}, chat_id={chat_id}")
-
-        # 播放命令处理
-        if content.startswith(self.play_command):
-            logger.info("处理播放命令")
-            return await self._handle_play_command(bot, chat_id, content)
-
-        # 剧集选择命令处理
-        if content.startswith("序号 "):
-            logger.info("处理剧集选择命令")
-            return await self._handle_episode_selection(bot, chat_id, content)
-
-        # 剧集翻页命令处理
-        if content in ["下一页", "上一页", "最后一页"]:
-            logger.info("处理剧集翻页命令")
-            return await self._handle_episode_navigation(bot, chat_id, content)
-
-        # 搜索命令处理
-        for command in self.commands:
-            if command in content:  # 使用 in 关键字进行模糊匹配
-                logger.info(f"处理搜索命令: {command}")
-                return await self._handle_search_command(bot, chat_id, content)
-
-        #  处理直接播放第几集
-        if content.startswith("第") and content.endswith("集"):
-            try:
-                episode_number = int(content[1:-1])
-                logger.info(f"尝试直接播放第{episode_number}集")
-                # 递归调用，传递正确的序号选择消息
-                content = f"序号 {episode_number}"
-                return await self._handle_episode_selection(bot, chat_id, content)
-            except ValueError:
-                await bot.send_text_message(chat_id, "请输入有效的剧集数字编号。")
-                return False
-
-        logger.info("没有匹配到任何命令，不处理消息")
-        return True  # 没有匹配到任何命令，不阻塞
+        chat_id = message["FromWxid"]
+        command = match.lastgroup
+        logger.info(f"处理命令 {command}: content={content}, chat_id={chat_id}")
+        self.metrics.incr(f"command.{command}")
+        try:
+            with self.metrics.timer(f"handler.{command}"):
+                return await self._coordinator.run(chat_id, command, lambda: self._command_routes[command](bot, chat_id, content))
+        except _UpstreamBusy as e:
+            await self._send_text(bot, chat_id, e.message)
+            return False